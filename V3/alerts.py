@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+
+import httpx
+
+# httpx logs every request URL at INFO, and Bot API URLs contain the bot token
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('httpcore').setLevel(logging.WARNING)
+
+_STOP = object()
+
+
+class Alert:
+    __slots__ = ('coin', 'rule', 'direction', 'value', 'reference', 'timestamp')
+
+    def __init__(self, coin, rule, direction, value, reference, timestamp):
+        self.coin = coin
+        self.rule = rule  # '24h_extreme', '30d_extreme', 'change_1hour' or 'zscore'
+        self.direction = direction  # 'up' or 'down'
+        self.value = value  # volume of the sample that triggered the alert
+        self.reference = reference  # previous extreme, volume an hour ago, or the z-score
+        self.timestamp = timestamp
+
+    @property
+    def key(self):
+        # Alerts with the same key are duplicates of each other
+        return (self.coin, self.rule, self.direction)
+
+    def text(self):
+        coin = self.coin.upper()
+        if self.rule in ('24h_extreme', '30d_extreme'):
+            window = '24h' if self.rule == '24h_extreme' else '30 day'
+            kind = 'high' if self.direction == 'up' else 'low'
+            return (f"{coin}: new {window} volume {kind} {self.value:,.0f} "
+                    f"(previous {self.reference:,.0f})")
+        if self.rule == 'change_1hour':
+            change = (self.value - self.reference) / self.reference * 100
+            return f"{coin}: volume {change:+.1f}% in the last hour ({self.reference:,.0f} -> {self.value:,.0f})"
+        return f"{coin}: unusual volume {self.value:,.0f} (z-score {self.reference:+.1f})"
+
+    __str__ = text
+
+    def __repr__(self):
+        return f'<Alert {self.coin} {self.rule} {self.direction} {self.value}>'
+
+
+class _CoinAlertState:
+    __slots__ = ('extremes', 'mean', 'variance', 'samples')
+
+    def __init__(self):
+        self.extremes = {}  # (window, 'max'/'min') -> the window extreme at the last evaluation
+        self.mean = 0.0
+        self.variance = 0.0
+        self.samples = 0
+
+
+class AlertEngine:
+    # Volume alert rules, evaluated incrementally for every applied sample:
+    #
+    # - a sample that beats the previous 24h or 30d volume high (or low)
+    # - a volume change of at least change_threshold percent against the
+    #   '-1hour' lookback sample
+    # - a volume z-score of at least z_threshold, against an exponentially
+    #   weighted mean and variance (alpha z_alpha) of the coin's earlier samples
+    #
+    # Each rule only keeps O(1) state per coin, so evaluate() costs a few
+    # comparisons and float operations per sample. An alert is dropped when
+    # one with the same coin, rule and direction fired less than cooldown ago,
+    # otherwise it is handed to notify(alert), which must not block.
+    #
+    # evaluate() for a coin must not run concurrently with itself; the
+    # servers call it under coins_history.lock(coin).
+
+    def __init__(self, notify=None, change_threshold=25.0, z_threshold=4.0, z_alpha=0.05, z_warmup=30,
+                 cooldown=timedelta(minutes=30)):
+        self.notify = notify
+        self.change_threshold = change_threshold
+        self.z_threshold = z_threshold
+        self.z_alpha = z_alpha
+        self.z_warmup = z_warmup
+        self.cooldown = cooldown
+        self.alerts_fired = 0
+        self.alerts_suppressed = 0
+        self._coins = {}
+        self._last_fired = {}  # alert key -> timestamp it last fired
+
+    def evaluate(self, coin, samples, history, windows):
+        # samples: the Samples just applied, oldest first; history and windows
+        # are the coin's state with those samples already in. Returns the
+        # alerts that fired.
+        state = self._coins.get(coin)
+        if state is None:
+            state = self._coins[coin] = _CoinAlertState()
+        alerts = []
+        for sample in samples:
+            self._check_zscore(coin, sample, state, alerts)
+        latest = samples[-1]
+        self._check_extremes(coin, latest, samples[0].timestamp, windows, state, alerts)
+        self._check_change(coin, latest, history.get('-1hour'), alerts)
+        return [alert for alert in alerts if self._fire(alert)]
+
+    def _check_extremes(self, coin, latest, first_timestamp, windows, state, alerts):
+        fired = set()
+        # 30d first, so a sample that is both only raises the 30 day alert
+        for rule, window in (('30d_extreme', '30d'), ('24h_extreme', '24h')):
+            for side, direction in (('max', 'up'), ('min', 'down')):
+                extreme = getattr(windows[window], side)()
+                previous = state.extremes.get((window, side))
+                state.extremes[(window, side)] = extreme
+                # Only samples of this batch can be new extremes, and only against
+                # an extreme seen before (not on the first evaluation after a start)
+                if extreme is None or previous is None or extreme is previous or extreme.timestamp < first_timestamp:
+                    continue
+                beaten = extreme.volume > previous.volume if side == 'max' else extreme.volume < previous.volume
+                if beaten and direction not in fired:
+                    fired.add(direction)
+                    alerts.append(Alert(coin, rule, direction, extreme.volume, previous.volume, latest.timestamp))
+
+    def _check_change(self, coin, latest, hour_ago, alerts):
+        if hour_ago is None or not hour_ago.volume:
+            return
+        change = (latest.volume - hour_ago.volume) / hour_ago.volume * 100
+        if abs(change) >= self.change_threshold:
+            direction = 'up' if change > 0 else 'down'
+            alerts.append(Alert(coin, 'change_1hour', direction, latest.volume, hour_ago.volume, latest.timestamp))
+
+    def _check_zscore(self, coin, sample, state, alerts):
+        # Scores the sample against the samples before it, then folds it in
+        volume = sample.volume
+        difference = volume - state.mean
+        if state.samples >= self.z_warmup and state.variance > 0:
+            z = difference / math.sqrt(state.variance)
+            if abs(z) >= self.z_threshold:
+                alerts.append(Alert(coin, 'zscore', 'up' if z > 0 else 'down', volume, z, sample.timestamp))
+        if state.samples == 0:
+            state.mean = volume
+        else:
+            increment = self.z_alpha * difference
+            state.mean += increment
+            state.variance = (1 - self.z_alpha) * (state.variance + difference * increment)
+        state.samples += 1
+
+    def _fire(self, alert):
+        last = self._last_fired.get(alert.key)
+        if last is not None and alert.timestamp - last < self.cooldown:
+            self.alerts_suppressed += 1
+            return False
+        self._last_fired[alert.key] = alert.timestamp
+        self.alerts_fired += 1
+        logging.info("Alert: %s", alert)  # formatted only when INFO is enabled
+        if self.notify is not None:
+            self.notify(alert)
+        return True
+
+
+class TelegramNotifier:
+    # Sends alerts through the Telegram Bot API (sendMessage) from an asyncio
+    # loop on its own thread, so notify() only hands the alert over and
+    # returns.
+    #
+    # At most `rate` messages are sent per `per` seconds (a token bucket);
+    # alerts beyond that wait their turn in a queue of max_pending, and are
+    # dropped once it is full. A failed send is retried `retries` times with
+    # backoff, honouring the retry_after of a 429 answer.
+    #
+    # base_url points at the Bot API; tests point it at a local stub.
+
+    def __init__(self, token, chat_id, base_url='https://api.telegram.org', rate=20, per=60.0, retries=3,
+                 timeout=10.0, max_pending=1000):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url.rstrip('/')
+        self.rate = rate
+        self.per = per
+        self.retries = retries
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        # None unless TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID are set
+        token = os.environ.get('TELEGRAM_BOT_TOKEN')
+        chat_id = os.environ.get('TELEGRAM_CHAT_ID')
+        if not token or not chat_id:
+            return None
+        return cls(token, chat_id, base_url=os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org'))
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        # Safe to call more than once, only the first call starts the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='telegram-notifier', daemon=True)
+                self._thread.start()
+                self._ready.wait()
+
+    def notify(self, alert):
+        self.start()
+        try:
+            self._loop.call_soon_threadsafe(self._enqueue, alert.text())
+        except RuntimeError:  # the loop is closed, after stop()
+            self.dropped += 1
+
+    def stop(self, timeout=10):
+        # Send what is queued (within timeout) and stop the loop
+        if not self.running:
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Telegram notifier did not finish within {timeout}s, "
+                          f"{self._queue.qsize()} messages left unsent")
+
+    def _enqueue(self, text):
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            logging.error(f"Telegram notifier is backed up, dropping alert: {text}")
+            return
+        self._queue.put_nowait(text)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        try:
+            self._loop.run_until_complete(self._send_forever())
+        finally:
+            self._loop.close()
+
+    async def _send_forever(self):
+        tokens = self.rate
+        refilled = time.monotonic()
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+            while True:
+                text = await self._queue.get()
+                if text is _STOP:
+                    break
+                # Token bucket: wait until a message may go out
+                while True:
+                    now = time.monotonic()
+                    tokens = min(self.rate, tokens + (now - refilled) * self.rate / self.per)
+                    refilled = now
+                    if tokens >= 1:
+                        tokens -= 1
+                        break
+                    await asyncio.sleep((1 - tokens) * self.per / self.rate)
+                await self._send(client, text)
+
+    async def _send(self, client, text):
+        payload = {'chat_id': self.chat_id, 'text': text, 'disable_web_page_preview': True}
+        for attempt in range(1, self.retries + 1):
+            delay = 0.5 * 2 ** (attempt - 1)
+            try:
+                response = await client.post(f'/bot{self.token}/sendMessage', json=payload)
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    self.sent += 1
+                    return
+                error = f"HTTP {response.status_code}"
+                if response.status_code == 429:
+                    try:
+                        delay = float(response.json()['parameters']['retry_after'])
+                    except (ValueError, KeyError, TypeError):
+                        pass
+                elif response.status_code < 500:
+                    break  # the request itself is wrong, retrying won't help
+            if attempt < self.retries:
+                logging.warning(f"Sending Telegram alert failed ({error}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+        self.failed += 1
+        logging.error(f"Sending Telegram alert failed ({error}): {text}")
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,251 @@
+# Batched volume statistics of every coin over the stored coin_history rows,
+# for offline analysis next to the live dashboard. The servers don't use it:
+# per tick their TimeIndex bisection and monotonic-deque windows are cheaper
+# than a batched recomputation, and the dashboard rows are cached per coin.
+#
+#   python analytics.py --database sqlite:///instance/coinsNEW.db
+#   python analytics.py --database sqlite:///instance/coinsNEW.db --save columns/
+#   python analytics.py --columns columns/ --at 2024-04-06T00:00:00
+#
+# The rows are loaded into columnar NumPy arrays per coin (epoch seconds,
+# volume, price), which --save writes as .npy files and --columns maps back
+# into memory. dashboard_stats() then works out every coin's lookbacks, volume
+# changes and window extremes in one batched computation, printed as JSON.
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from db_migrations import parse_price, parse_volume
+from history_store import LOOKBACK_MARKS
+from volume_windows import WINDOWS
+
+EPOCH = datetime(1970, 1, 1)  # the servers keep naive UTC datetimes
+
+# The dashboard's lookback marks, as dashboard_stats() takes them
+DASHBOARD_MARKS = {key: timedelta(minutes=minutes) for minutes, key in LOOKBACK_MARKS}
+
+
+def epoch_seconds(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+class DashboardStats:
+    # What dashboard_stats() works out, one row per coin in the order of
+    # `coins`. Samples are referred to by their position in the concatenated
+    # times/volumes/prices columns, -1 meaning none; those columns end with a
+    # NaN entry, so that position -1 reads as NaN.
+    __slots__ = ('coins', 'marks', 'windows', 'times', 'volumes', 'prices', 'latest', 'lookbacks', 'change',
+                 'window_min', 'window_max')
+
+    def __init__(self, coins, marks, windows, times, volumes, prices, latest, lookbacks, change, window_min,
+                 window_max):
+        self.coins = coins
+        self.marks = marks  # lookback keys, the columns of `lookbacks` and `change`
+        self.windows = windows  # window names, the keys of window_min and window_max
+        self.times = times
+        self.volumes = volumes
+        self.prices = prices
+        self.latest = latest  # (coins,) newest sample at or before now
+        self.lookbacks = lookbacks  # (coins, marks) newest sample at or before each mark
+        self.change = change  # (coins, marks) volume change in percent from the lookback to the latest sample
+        self.window_min = window_min  # {window: (coins,)} lowest volume in the window, the newest of equal ones
+        self.window_max = window_max
+
+    def as_dict(self):
+        # {coin: statistics} with plain Python values, for JSON
+        times, volumes, prices = self.times.tolist(), self.volumes.tolist(), self.prices.tolist()
+
+        def sample(position):
+            if position < 0:
+                return None
+            price = prices[position]
+            return {'timestamp': (EPOCH + timedelta(seconds=times[position])).isoformat(),
+                    'volume': volumes[position], 'price': None if price != price else price}
+
+        latest, lookbacks, change = self.latest.tolist(), self.lookbacks.tolist(), self.change.tolist()
+        window_min = {name: positions.tolist() for name, positions in self.window_min.items()}
+        window_max = {name: positions.tolist() for name, positions in self.window_max.items()}
+        result = {}
+        for row, coin in enumerate(self.coins):
+            coin_lookbacks = {}
+            for column, key in enumerate(self.marks):
+                entry = sample(lookbacks[row][column])
+                if entry is not None:
+                    percent = change[row][column]
+                    entry['change_percent'] = None if percent != percent else round(percent, 4)
+                coin_lookbacks[key] = entry
+            result[coin] = {
+                'latest': sample(latest[row]),
+                'lookbacks': coin_lookbacks,
+                'windows': {name: {'min': sample(window_min[name][row]), 'max': sample(window_max[name][row])}
+                            for name in self.windows},
+            }
+        return result
+
+
+def dashboard_stats(columns, now, marks, windows):
+    # The dashboard statistics of every coin in one batched computation.
+    #
+    # columns: {coin: (times, volumes, prices)} in timestamp order, from
+    # columns_from_database() or load_columns(). marks: {key: timedelta before
+    # now} of the lookbacks. windows: {name: timedelta} of the volume windows,
+    # which hold the samples with now - span <= timestamp <= now like
+    # volume_windows.WindowedExtremes.
+    #
+    # The coins' columns are concatenated and every coin's times shifted into
+    # a band of its own, so a single searchsorted resolves a mark for all
+    # coins at once, and the window extremes are one minimum/maximum.reduceat
+    # over the samples inside the windows.
+    coins = list(columns)
+    parts = [columns[coin] for coin in coins]
+    lengths = np.array([len(part[0]) for part in parts], dtype=np.int64)
+    offsets = np.zeros(len(coins) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    pad = [np.full(1, np.nan)]
+    times = np.concatenate([np.asarray(part[0], dtype=float) for part in parts] + pad)
+    volumes = np.concatenate([np.asarray(part[1], dtype=float) for part in parts] + pad)
+    prices = np.concatenate([np.asarray(part[2], dtype=float) for part in parts] + pad)
+
+    now_seconds = epoch_seconds(now)
+    mark_seconds = np.array([now_seconds - delta.total_seconds() for delta in marks.values()], dtype=float)
+    window_starts = {name: now_seconds - span.total_seconds() for name, span in windows.items()}
+    oldest = min([now_seconds, *mark_seconds.tolist(), *window_starts.values()])
+    newest = now_seconds
+    if len(times) > 1:
+        oldest = min(oldest, float(np.nanmin(times)))
+        newest = max(newest, float(np.nanmax(times)))
+    # key = time + band: every coin's keys are sorted and above the previous coin's
+    band = np.arange(len(coins), dtype=float) * (newest - oldest + 1) - oldest
+    keys = times[:-1] + np.repeat(band, lengths)
+    first = offsets[:-1]
+
+    def newest_until(query):
+        # (coins, n) positions of the newest sample at or before query[coin, n], -1 for none
+        positions = np.searchsorted(keys, query + band[:, None], 'right') - 1
+        return np.where(positions >= first[:, None], positions, -1)
+
+    latest = newest_until(np.full((len(coins), 1), now_seconds))[:, 0]
+    lookbacks = newest_until(np.broadcast_to(mark_seconds, (len(coins), len(mark_seconds))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reference = volumes[lookbacks]
+        change = (volumes[latest][:, None] - reference) / reference * 100
+    change[(lookbacks < 0) | (reference == 0)] = np.nan
+
+    end = latest + 1
+    end[latest < 0] = first[latest < 0]
+    window_min, window_max = {}, {}
+    for name, start_seconds in window_starts.items():
+        start = np.minimum(np.searchsorted(keys, start_seconds + band, 'left'), end)
+        counts = end - start
+        lowest = np.full(len(coins), -1, dtype=np.int64)
+        highest = np.full(len(coins), -1, dtype=np.int64)
+        if counts.any():
+            # Gather the samples of all windows back to back; segment i starts at segments[i]
+            segments = np.cumsum(counts) - counts
+            inside = np.arange(counts.sum()) + np.repeat(start - segments, counts)
+            values = volumes[inside]
+            occupied = counts > 0
+            for positions, reduce in ((lowest, np.minimum), (highest, np.maximum)):
+                extremes = reduce.reduceat(values, segments[occupied])
+                # The newest sample with the extreme volume, as the monotonic deques keep it
+                matching = np.where(values == np.repeat(extremes, counts[occupied]), inside, -1)
+                positions[occupied] = np.maximum.reduceat(matching, segments[occupied])
+        window_min[name] = lowest
+        window_max[name] = highest
+
+    return DashboardStats(coins, list(marks), list(windows), times, volumes, prices, latest, lookbacks, change,
+                          window_min, window_max)
+
+
+def save_columns(directory, columns):
+    # Writes {coin: (times, volumes, prices)} as one <coin>.npy per coin, a
+    # (3, n) block whose rows are the columns, through a temp file and rename
+    os.makedirs(directory, exist_ok=True)
+    for coin, (times, volumes, prices) in columns.items():
+        path = os.path.join(directory, quote(coin, safe='') + '.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, np.stack([times, volumes, prices]).astype(float, copy=False))
+        os.replace(path + '.tmp', path)
+
+
+def load_columns(directory, mmap_mode='r'):
+    # {coin: (times, volumes, prices)} from save_columns(). Memory-mapped by
+    # default, so a computation only reads the pages it touches.
+    columns = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.npy'):
+            block = np.load(os.path.join(directory, name), mmap_mode=mmap_mode)
+            columns[unquote(name[:-len('.npy')])] = (block[0], block[1], block[2])
+    return columns
+
+
+def _as_datetime(timestamp):
+    return datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
+
+
+def columns_from_database(database_url, until=None, days=None):
+    # {coin: (times, volumes, prices)} of the coin_history rows up to `until`
+    # (default: the newest row), going back `days`. Volume and price are
+    # parsed when they are still text (a database from before the REAL
+    # columns migration); an unparsable price becomes NaN.
+    from sqlalchemy import create_engine, text
+
+    rows = {}
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        if until is None:
+            until = _as_datetime(connection.execute(text('SELECT MAX(timestamp) FROM coin_history')).scalar())
+            if until is None:
+                engine.dispose()
+                return {}
+        query = 'SELECT coin_name, timestamp, volume, price FROM coin_history WHERE timestamp <= :until'
+        # Bound as text in SQLite's own format, which is how the rows are stored
+        params = {'until': until.isoformat(' ')}
+        if days is not None:
+            query += ' AND timestamp >= :since'
+            params['since'] = (until - timedelta(days=days)).isoformat(' ')
+        query += ' ORDER BY coin_name, timestamp'
+        for row in connection.execution_options(yield_per=10000).execute(text(query), params):
+            price = parse_price(row.price)
+            rows.setdefault(row.coin_name, []).append(
+                (epoch_seconds(_as_datetime(row.timestamp)), parse_volume(row.volume) or 0.0, np.nan if price is None else price))
+    engine.dispose()
+    columns = {}
+    for coin, coin_rows in rows.items():
+        block = np.array(coin_rows, dtype=float).T
+        columns[coin] = (block[0], block[1], block[2])
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched volume statistics of every coin')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--database', help='SQLAlchemy URL of the database to read')
+    source.add_argument('--columns', help='directory written by --save, memory-mapped')
+    parser.add_argument('--save', help='write the loaded columns to this directory')
+    parser.add_argument('--at', help='ISO timestamp the statistics are taken at (default: the newest row)')
+    parser.add_argument('--days', type=float, default=31.0, help='days of rows read from --database, up to --at')
+    args = parser.parse_args()
+
+    at = datetime.fromisoformat(args.at) if args.at else None
+    if args.database:
+        columns = columns_from_database(args.database, until=at, days=args.days)
+    else:
+        columns = load_columns(args.columns)
+    if args.save:
+        save_columns(args.save, columns)
+    if at is None:
+        newest = [float(times[-1]) for times, _, _ in columns.values() if len(times)]
+        at = EPOCH + timedelta(seconds=max(newest)) if newest else datetime.utcnow()
+    stats = dashboard_stats(columns, at, DASHBOARD_MARKS, WINDOWS)
+    json.dump({'at': at.isoformat(), 'coins': stats.as_dict()}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
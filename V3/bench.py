@@ -0,0 +1,401 @@
+# Benchmarks of the ingest, dashboard, API and chart paths, driven through the
+# Flask test client with synthetic multi-coin tick streams.
+#
+#   python bench.py --app serverDbCharts --out bench.json
+#   python bench.py --quick                 # smaller sizes, for a quick check
+#   python bench.py --only ingest,api
+#
+# Every scenario runs in a fresh process with its own temporary database and
+# history files, and the ticks come from a seeded RNG, so two runs (or two
+# commits) measure the same work. The results are written as JSON, with the
+# git commit they were taken at.
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SIZES = {
+    'full': {
+        'ingest_coins': 50, 'ingest_ticks': 5000,
+        'dashboard_coins': [10, 100, 500], 'dashboard_depths': [15, 300], 'dashboard_repeat': 20,
+        'api_rows': 200000, 'api_coins': 50, 'api_repeat': 50,
+        'chart_rows': 20000, 'chart_coins': 3, 'chart_repeat': 5,
+    },
+    'quick': {
+        'ingest_coins': 20, 'ingest_ticks': 500,
+        'dashboard_coins': [10, 100], 'dashboard_depths': [15, 300], 'dashboard_repeat': 5,
+        'api_rows': 20000, 'api_coins': 20, 'api_repeat': 10,
+        'chart_rows': 2000, 'chart_coins': 2, 'chart_repeat': 2,
+    },
+}
+
+
+def summarize(seconds):
+    # Latency percentiles in milliseconds
+    ordered = sorted(seconds)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50_ms': round(percentile(0.50), 4),
+        'p90_ms': round(percentile(0.90), 4),
+        'p99_ms': round(percentile(0.99), 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+
+
+def timed(call, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def coin_names(count):
+    return [f'coin{n:04d}' for n in range(count)]
+
+
+def synthetic_ticks(coins, count, seed):
+    # Round-robin ticks, each coin's volume and price a seeded random walk
+    rng = random.Random(seed)
+    volumes = {coin: rng.uniform(1e5, 1e9) for coin in coins}
+    prices = {coin: rng.uniform(0.01, 50000) for coin in coins}
+    for n in range(count):
+        coin = coins[n % len(coins)]
+        change = rng.gauss(0, 0.01)
+        volumes[coin] *= math.exp(rng.gauss(0, 0.02))
+        prices[coin] *= math.exp(change)
+        yield {
+            'name': coin,
+            'volume': f'{volumes[coin]:,.0f}',
+            'change': f'{change * 100:.2f}%',
+            'direction': 'Increase' if change >= 0 else 'Decrease',
+            'price': f'${prices[coin]:,.4f}',
+        }
+
+
+def history_rows(coins, rows, seed, end):
+    # coin_history rows spread one minute apart per coin, ending at `end`
+    per_coin = rows // len(coins)
+    rng = random.Random(seed)
+    for coin in coins:
+        volume = rng.uniform(1e5, 1e9)
+        price = rng.uniform(0.01, 50000)
+        for n in range(per_coin):
+            volume *= math.exp(rng.gauss(0, 0.02))
+            price *= math.exp(rng.gauss(0, 0.01))
+            yield {'coin_name': coin, 'timestamp': end - timedelta(minutes=per_coin - n), 'volume': volume,
+                   'change': '0.00%', 'direction': 'Increase', 'price': price}
+
+
+def load_app(app_module, workdir):
+    # Imports the server with its database and history files in workdir
+    os.chdir(workdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    for name in ('TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID'):
+        os.environ.pop(name, None)  # never send alerts from a benchmark
+    sys.path.insert(0, HERE)
+    server = importlib.import_module(app_module)
+    app = server.app
+    # The templates sit next to the modules in this tree; deployments put them in templates/
+    if not os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        app.template_folder = app.root_path
+    with app.app_context():
+        server.migrate(server.db.engine)
+        server.db.create_all()
+    return server
+
+
+def insert_rows(server, rows, chunk=10000):
+    table = server.CoinHistory.__table__
+    batch = []
+    with server.db.engine.begin() as connection:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+        server.rebuild_rollups(connection)
+
+
+def wait_drained(server, rows, timeout=120):
+    # Until every queued update is applied and `rows` rows in total are written
+    deadline = time.monotonic() + timeout
+    while server.ingest_pipeline.pending() or server.db_writer.rows_written + server.db_writer.rows_dropped < rows:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Ingest did not drain")
+        time.sleep(0.002)
+
+
+def bench_ingest(server, sizes, seed):
+    client = server.app.test_client()
+    coins = coin_names(sizes['ingest_coins'])
+    ticks = list(synthetic_ticks(coins, sizes['ingest_ticks'], seed))
+    for tick in ticks[:len(coins)]:  # warm up: every coin exists, the threads run
+        client.post('/update_coin', json=tick)
+    wait_drained(server, len(coins))
+
+    latencies = []
+    started = time.perf_counter()
+    for tick in ticks:
+        request_started = time.perf_counter()
+        response = client.post('/update_coin', json=tick)
+        latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 204, response.status_code
+    posted = time.perf_counter() - started
+    wait_drained(server, len(coins) + len(ticks))
+    applied = time.perf_counter() - started
+
+    # The same ticks sent as /update_coins batches of one record per coin
+    batches = [ticks[n:n + len(coins)] for n in range(0, len(ticks), len(coins))]
+    batch_latencies = []
+    batch_started = time.perf_counter()
+    for batch in batches:
+        request_started = time.perf_counter()
+        response = client.post('/update_coins', json=batch)
+        batch_latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 200, response.status_code
+    wait_drained(server, len(coins) + 2 * len(ticks))
+    batch_applied = time.perf_counter() - batch_started
+
+    return {
+        'update_coin': {
+            'requests': len(ticks),
+            'coins': len(coins),
+            'requests_per_second': round(len(ticks) / posted, 1),
+            'applied_per_second': round(len(ticks) / applied, 1),
+            'latency': summarize(latencies),
+        },
+        'update_coins': {
+            'requests': len(batches),
+            'records_per_request': len(coins),
+            'records_applied_per_second': round(len(ticks) / batch_applied, 1),
+            'latency': summarize(batch_latencies),
+        },
+    }
+
+
+def bench_dashboard(server, sizes, seed, coins_count, depth):
+    # Seeds `depth` samples per coin one minute apart, then times / with every
+    # row invalidated (cold) and with the cached rows (warm)
+    client = server.app.test_client()
+    coins = coin_names(coins_count)
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    for coin in coins:
+        volume = rng.uniform(1e5, 1e9)
+        samples = []
+        for n in range(depth):
+            volume *= math.exp(rng.gauss(0, 0.02))
+            samples.append({'timestamp': now - timedelta(minutes=depth - n), 'change': '0.10%',
+                            'direction': 'Increase', 'price': '$1.00', 'volume': volume})
+        server.update_history_with_new_samples(coin, samples, journal=False)
+
+    def cold():
+        for coin in coins:
+            server.dashboard_rows.invalidate(coin)
+        assert client.get('/').status_code == 200
+
+    def warm():
+        assert client.get('/').status_code == 200
+
+    warm()
+    repeat = sizes['dashboard_repeat']
+    return {
+        'coins': coins_count,
+        'history_depth': depth,
+        'cold': summarize(timed(cold, repeat)),
+        'warm': summarize(timed(warm, repeat)),
+    }
+
+
+def bench_api(server, sizes, seed):
+    client = server.app.test_client()
+    coins = coin_names(sizes['api_coins'])
+    end = datetime.utcnow()
+    with server.app.app_context():
+        insert_rows(server, history_rows(coins, sizes['api_rows'], seed, end))
+    rng = random.Random(seed)
+    total = sizes['api_rows'] // len(coins) * len(coins)
+    repeat = sizes['api_repeat']
+
+    def page():
+        response = client.get(f'/api/coin_history?after_id={rng.randrange(total)}&limit=1000')
+        assert response.status_code == 200
+
+    def coin_page():
+        response = client.get(f'/api/coin_history?coin={rng.choice(coins)}&limit=1000')
+        assert response.status_code == 200
+
+    def time_range():
+        since = (end - timedelta(hours=6)).isoformat()
+        response = client.get(f'/api/coin_history?coin={rng.choice(coins)}&since={since}&limit=1000')
+        assert response.status_code == 200
+
+    exported = []
+
+    def export():
+        response = client.get(f'/api/coin_history?coin={rng.choice(coins)}&format=ndjson')
+        exported.append(len(response.get_data()))
+
+    export_seconds = timed(export, max(1, repeat // 10))
+    return {
+        'rows': total,
+        'page_by_id': summarize(timed(page, repeat)),
+        'page_by_coin': summarize(timed(coin_page, repeat)),
+        'coin_last_6_hours': summarize(timed(time_range, repeat)),
+        'ndjson_export_one_coin': dict(summarize(export_seconds),
+                                       megabytes_per_second=round(sum(exported) / sum(export_seconds) / 1e6, 2)),
+    }
+
+
+def bench_charts(server, sizes, seed):
+    client = server.app.test_client()
+    coins = coin_names(sizes['chart_coins'])
+    with server.app.app_context():
+        insert_rows(server, history_rows(coins, sizes['chart_rows'] * len(coins), seed, datetime.utcnow()))
+    repeat = sizes['chart_repeat']
+    results = {'rows_per_coin': sizes['chart_rows']}
+    # Wait for every render instead of falling back on the outdated image after a second
+    server.CHART_STALE_WAIT = server.CHART_RENDER_TIMEOUT
+    try:
+        assert client.get(f'/charts/{coins[0]}').status_code == 200  # starts the render pool
+        for chart_range in ('24h', 'all'):
+            def cold():
+                for coin in coins:
+                    server.chart_cache.invalidate(coin)
+                    response = client.get(f'/charts/{coin}?range={chart_range}')
+                    assert response.status_code == 200 and 'Warning' not in response.headers
+
+            def warm():
+                for coin in coins:
+                    assert client.get(f'/charts/{coin}?range={chart_range}').status_code == 200
+
+            def data():
+                for coin in coins:
+                    assert client.get(f'/api/charts/{coin}?range={chart_range}').status_code == 200
+
+            results[chart_range] = {
+                'render': summarize([seconds / len(coins) for seconds in timed(cold, repeat)]),
+                'cached': summarize([seconds / len(coins) for seconds in timed(warm, repeat)]),
+                'api_data': summarize([seconds / len(coins) for seconds in timed(data, repeat)]),
+            }
+    finally:
+        server.chart_renderer.shutdown()
+    return results
+
+
+def run_scenario(app_module, name, sizes, seed, options, results):
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        server = load_app(app_module, workdir)
+        if name == 'ingest':
+            result = bench_ingest(server, sizes, seed)
+        elif name == 'dashboard':
+            result = bench_dashboard(server, sizes, seed, **options)
+        elif name == 'api':
+            result = bench_api(server, sizes, seed)
+        else:
+            result = bench_charts(server, sizes, seed)
+        # Let the background threads finish before the database goes away
+        server.ingest_pipeline.stop()
+        server.db_writer.stop()
+        results.send(result)
+        os.chdir(HERE)
+
+
+def in_fresh_process(app_module, name, sizes, seed, options=None):
+    # spawn, not fork: every scenario imports (and loads) the server from scratch.
+    # Not a daemon, so the chart scenario can start its render pool.
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_scenario, args=(app_module, name, sizes, seed, options or {}, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        return {'error': f"scenario exited with code {process.exitcode}"}
+    return result
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingest, dashboard, API and chart paths')
+    parser.add_argument('--app', default='serverDbCharts', help='server module (serverV3 or serverDbCharts)')
+    parser.add_argument('--only', default='ingest,dashboard,api,charts', help='comma separated scenarios')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    sizes = SIZES['quick' if args.quick else 'full']
+    scenarios = [name for name in args.only.split(',') if name]
+    commit, dirty = git_revision()
+    report = {
+        'meta': {
+            'app': args.app,
+            'commit': commit,
+            'dirty': dirty,
+            'started': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'sizes': sizes,
+        },
+        'results': {},
+    }
+    for name in scenarios:
+        print(f"Running {name}...", file=sys.stderr)
+        if name == 'dashboard':
+            report['results'][name] = [
+                in_fresh_process(args.app, name, sizes, args.seed, {'coins_count': coins, 'depth': depth})
+                for coins in sizes['dashboard_coins'] for depth in sizes['dashboard_depths']]
+        elif name == 'charts' and args.app != 'serverDbCharts':
+            report['results'][name] = {'skipped': f"{args.app} has no charts"}
+        elif name in ('ingest', 'api', 'charts'):
+            report['results'][name] = in_fresh_process(args.app, name, sizes, args.seed)
+        else:
+            parser.error(f"Unknown scenario {name}")
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
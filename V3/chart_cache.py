@@ -0,0 +1,98 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class CachedChart:
+    __slots__ = ('png', 'etag', 'last_modified', 'version')
+
+    def __init__(self, png, last_modified, version):
+        self.png = png
+        self.etag = hashlib.sha1(png).hexdigest()
+        self.last_modified = last_modified
+        self.version = version
+
+
+class ChartCache:
+    # LRU cache of rendered chart PNGs keyed by (coin, range, size, points,
+    # time bucket), bounded by the total size of the images it holds.
+    #
+    # Every coin has a version number that invalidate() bumps when new samples
+    # for it are stored. Entries rendered at an older version are no longer
+    # returned by get(), but they are kept (until the LRU evicts them) so that
+    # peek() can still hand them out as a stale image while a fresh one renders.
+    #
+    # hits and misses count get() only, one per chart request.
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._modified = {}
+        self._lock = threading.Lock()
+
+    def version(self, coin):
+        return self._versions.get(coin, 0)
+
+    def modified(self, coin):
+        # When data for the coin last changed, as far as this process knows
+        return self._modified.get(coin)
+
+    def invalidate(self, coin):
+        with self._lock:
+            self._versions[coin] = self._versions.get(coin, 0) + 1
+            self._modified[coin] = datetime.utcnow()
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def sync_versions(self, versions):
+        # Adopts the versions of another process' cache (see serve.py), which
+        # invalidates the coins that were bumped there
+        with self._lock:
+            for coin, version in versions.items():
+                if self._versions.get(coin, 0) != version:
+                    self._versions[coin] = version
+                    self._modified[coin] = datetime.utcnow()
+
+    def get(self, key):
+        coin = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != self._versions.get(coin, 0):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, key):
+        # The entry for key even when it is stale, or None; not counted as a hit or miss
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, png, version):
+        # version is the coin's version() read *before* the data was queried, so
+        # a sample stored during the render leaves the entry stale
+        coin = key[0]
+        entry = CachedChart(png, self._modified.get(coin) or datetime.utcnow(), version)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous.png)
+            if len(png) > self.max_bytes:
+                return entry  # never fits, serve it uncached
+            self._entries[key] = entry
+            self.size_bytes += len(png)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.png)
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
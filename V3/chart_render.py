@@ -0,0 +1,161 @@
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Formatter function to convert numbers into K, M, B, T
+def human_readable_volume(x, pos):
+    if x >= 1e12:
+        return '{:1.1f}T'.format(x*1e-12)
+    if x >= 1e9:
+        return '{:1.1f}B'.format(x*1e-9)
+    if x >= 1e6:
+        return '{:1.1f}M'.format(x*1e-6)
+    if x >= 1e3:
+        return '{:1.1f}K'.format(x*1e-3)
+    return int(x)
+
+
+def render_chart_png(coin_name, timestamps, volumes, prices, size):
+    # Draws the volume/price chart and returns the PNG bytes. Runs inside the
+    # worker processes, so it only takes plain picklable data.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
+    fig, ax1 = plt.subplots(figsize=(size[0] / 100, size[1] / 100), dpi=100)
+
+    ax1.set_xlabel('Time')
+    ax1.set_ylabel('Volume', color='tab:blue')
+    ax1.plot(timestamps, volumes, color='tab:blue', label='Volume')
+    ax1.tick_params(axis='y', labelcolor='tab:blue')
+    ax1.yaxis.set_major_formatter(ticker.FuncFormatter(human_readable_volume))
+    ax1.legend(loc='upper left')
+
+    ax2 = ax1.twinx()
+    ax2.set_ylabel('Price (USD)', color='tab:red')
+    ax2.plot(timestamps, prices, color='tab:red', label='Price')
+    ax2.tick_params(axis='y', labelcolor='tab:red')
+    ax2.legend(loc='upper right')
+
+    plt.title(f'Volume and Price Over Time for {coin_name.capitalize()}')
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png')
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+class RendererBusy(Exception):
+    # Raised when max_pending renders are already queued or running
+    pass
+
+
+class ChartRenderer:
+    # Renders charts in a pool of worker processes, so matplotlib neither holds
+    # the GIL of the web server nor blocks its request threads.
+    #
+    # Jobs are deduplicated by key: while a chart is being rendered, every other
+    # request for the same key waits on the same future. on_done(key, tag, png)
+    # is called once per finished render, e.g. to store it in the ChartCache.
+    #
+    # When a worker dies (OOM kill, a crash in matplotlib) the pool is broken
+    # and its jobs fail with BrokenProcessPool. The pool is then dropped, so
+    # the next render starts a new one.
+
+    def __init__(self, max_workers=2, max_pending=16, on_done=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.on_done = on_done
+        self._executor = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the server process runs threads (scheduler,
+                # DB writer) whose locks must not be copied into the workers
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard_pool(self, executor):
+        # Drops a broken pool, unless another failed job already replaced it
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logging.error("Chart render pool is broken, starting a new one for the next render")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def pending(self):
+        return len(self._inflight)
+
+    def render(self, key, load_data):
+        # Returns a future for the PNG of key. load_data() is only called when no
+        # render for key is in flight; it returns (tag, render_chart_png args),
+        # or None when there is nothing to draw, in which case the future
+        # resolves to None. The tag is handed to on_done(key, tag, png).
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            if len(self._inflight) >= self.max_pending:
+                raise RendererBusy(f"{len(self._inflight)} charts already rendering")
+            future = Future()
+            self._inflight[key] = future
+
+        # The data is loaded outside the lock so different charts load in parallel
+        try:
+            loaded = load_data()
+            if loaded is None:
+                self._settle(key, future, None)
+                return future
+            tag, args = loaded
+            executor = self._pool()
+            job = executor.submit(render_chart_png, *args)
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                self._discard_pool(executor)
+            self._settle(key, future, exception=e)
+            raise
+        job.add_done_callback(lambda job: self._finished(key, tag, future, job, executor))
+        return future
+
+    def _settle(self, key, future, result=None, exception=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _finished(self, key, tag, future, job, executor):
+        if job.cancelled():
+            self._settle(key, future, exception=RuntimeError(f"Rendering chart {key} was cancelled"))
+            return
+        if job.exception() is not None:
+            logging.error(f"Rendering chart {key} failed: {job.exception()}")
+            if isinstance(job.exception(), BrokenProcessPool):
+                self._discard_pool(executor)
+            self._settle(key, future, exception=job.exception())
+            return
+        png = job.result()
+        if self.on_done is not None:
+            try:
+                self.on_done(key, tag, png)
+            except Exception as e:
+                logging.error(f"on_done callback for chart {key} failed: {e}")
+        self._settle(key, future, png)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
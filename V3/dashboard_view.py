@@ -0,0 +1,44 @@
+import threading
+
+
+class DashboardRows:
+    # Rendered <tr> of every coin on the dashboard, so that index() only
+    # re-renders the rows of coins that changed since the last request.
+    #
+    # build(coin, current_time) returns (html, expires): the row and the time
+    # from which it would render differently without any new sample, e.g. when
+    # its "mins ago" or its -30 mins lookback moves on. invalidate(coin) is
+    # called whenever the coin's history changes.
+
+    def __init__(self, build):
+        self.build = build
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, coin):
+        with self._lock:
+            self._versions[coin] = self._versions.get(coin, 0) + 1
+            self._rows.pop(coin, None)
+
+    def row(self, coin, current_time):
+        cached = self._rows.get(coin)
+        if cached is not None and current_time < cached[1]:
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        version = self._versions.get(coin, 0)
+        html, expires = self.build(coin, current_time)
+        with self._lock:
+            # A sample stored while the row was built leaves it out of the cache
+            if self._versions.get(coin, 0) == version:
+                self._rows[coin] = (html, expires)
+        return html
+
+    def rows(self, coins, current_time):
+        return [self.row(coin, current_time) for coin in coins]
+
+    def __len__(self):
+        return len(self._rows)
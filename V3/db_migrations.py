@@ -0,0 +1,110 @@
+import logging
+import sys
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+from rollups import rebuild_rollups, rollup_table
+
+
+# Parse the scraped text values into numbers for the REAL columns
+def parse_price(price):
+    # '$60,123.45' -> 60123.45, anything unparsable ('Unavailable', '') -> None
+    if price is None or isinstance(price, (int, float)):
+        return price
+    try:
+        return float(str(price).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def parse_volume(volume):
+    if volume is None or isinstance(volume, (int, float)):
+        return volume
+    try:
+        return float(str(volume).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def _numeric_coin_history(connection):
+    # v0 -> v1: volume and price move from VARCHAR(20) text to REAL, and
+    # (coin_name, timestamp) gets an index so per-coin range queries are seeks
+    if not inspect(connection).has_table('coin_history'):
+        return  # new database, create_all() builds the current schema
+    connection.execute(text("DROP TABLE IF EXISTS coin_history_v1"))  # left over from an interrupted run
+    connection.execute(text("""
+        CREATE TABLE coin_history_v1 (
+            id INTEGER NOT NULL,
+            coin_name VARCHAR(50) NOT NULL,
+            timestamp DATETIME,
+            volume FLOAT,
+            change VARCHAR(20),
+            direction VARCHAR(20),
+            price FLOAT,
+            PRIMARY KEY (id)
+        )
+    """))
+
+    insert = text("INSERT INTO coin_history_v1 (id, coin_name, timestamp, volume, change, direction, price) "
+                  "VALUES (:id, :coin_name, :timestamp, :volume, :change, :direction, :price)")
+    rows = connection.execute(text(
+        "SELECT id, coin_name, timestamp, volume, change, direction, price FROM coin_history ORDER BY id"))
+    converted = 0
+    while True:
+        chunk = rows.fetchmany(5000)
+        if not chunk:
+            break
+        connection.execute(insert, [{
+            'id': row.id,
+            'coin_name': row.coin_name,
+            'timestamp': row.timestamp,
+            'volume': parse_volume(row.volume),
+            'change': row.change,
+            'direction': row.direction,
+            'price': parse_price(row.price),
+        } for row in chunk])
+        converted += len(chunk)
+
+    connection.execute(text("DROP TABLE coin_history"))
+    connection.execute(text("ALTER TABLE coin_history_v1 RENAME TO coin_history"))
+    connection.execute(text(
+        "CREATE INDEX ix_coin_history_coin_name_timestamp ON coin_history (coin_name, timestamp)"))
+    logging.info(f"Converted {converted} coin_history rows to numeric volume/price")
+
+
+def _coin_rollups(connection):
+    # v1 -> v2: 1m/5m/1h/1d OHLCV rollups, backfilled from coin_history
+    rollup_table.create(connection, checkfirst=True)
+    rebuild_rollups(connection)
+
+
+# MIGRATIONS[n] upgrades a database from schema version n to n + 1
+MIGRATIONS = [
+    _numeric_coin_history,
+    _coin_rollups,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(engine):
+    # Bring the database up to SCHEMA_VERSION. The version is kept in SQLite's
+    # PRAGMA user_version. Run this before db.create_all(); on a new database
+    # the migrations only create what create_all() does not know about.
+    with engine.begin() as connection:
+        version = connection.execute(text("PRAGMA user_version")).scalar()
+        for target in range(version, SCHEMA_VERSION):
+            started = time.perf_counter()
+            MIGRATIONS[target](connection)
+            connection.execute(text(f"PRAGMA user_version = {target + 1}"))
+            logging.info(f"Migrated database to schema version {target + 1} "
+                         f"in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    # One-shot backfill of an existing database file:
+    #   python db_migrations.py instance/coinsNEW.db
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 2:
+        sys.exit("usage: python db_migrations.py <path to sqlite db>")
+    migrate(create_engine(f'sqlite:///{sys.argv[1]}'))
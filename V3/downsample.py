@@ -0,0 +1,78 @@
+import numpy as np
+
+
+# Reduce long chart series to about as many points as the chart has pixels
+# before they are plotted. Both functions return the sorted indices of the
+# points to keep, always including the first and the last one.
+
+
+def minmax_buckets(values, buckets):
+    # Splits the series into equal-count buckets and keeps the lowest and the
+    # highest point of each, so every spike and every dip survives. NaNs never
+    # win a bucket unless the whole bucket is NaN.
+    n = len(values)
+    if buckets < 1 or n <= 2 * buckets:
+        return np.arange(n)
+    starts = (np.arange(buckets) * n) // buckets
+    bucket_of = np.repeat(np.arange(buckets), np.diff(np.append(starts, n)))
+
+    missing = np.isnan(values)
+    low = np.where(missing, np.inf, values)
+    high = np.where(missing, -np.inf, values)
+    bucket_min = np.minimum.reduceat(low, starts)
+    bucket_max = np.maximum.reduceat(high, starts)
+
+    # First position in each bucket that equals the bucket's min (max)
+    min_hits = np.flatnonzero(low == bucket_min[bucket_of])
+    max_hits = np.flatnonzero(high == bucket_max[bucket_of])
+    first_min = min_hits[np.unique(bucket_of[min_hits], return_index=True)[1]]
+    first_max = max_hits[np.unique(bucket_of[max_hits], return_index=True)[1]]
+    return np.unique(np.concatenate(([0, n - 1], first_min, first_max)))
+
+
+def lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets: keeps the point of each bucket that forms
+    # the largest triangle with the previously kept point and the average of
+    # the next bucket, which preserves the visual shape of the line.
+    n = len(x)
+    if points < 3 or n <= points:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64) - x[0]
+    y = np.asarray(y, dtype=np.float64)
+    if np.isnan(y).any():
+        # Only used to pick points, the gaps are still plotted as gaps
+        finite = y[~np.isnan(y)]
+        y = np.where(np.isnan(y), finite.mean() if len(finite) else 0.0, y)
+
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_end = max(next_end, next_start + 1)
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        area = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return np.unique(selected)
+
+
+def downsample_chart(timestamps, volumes, prices, points):
+    # Picks about `points` samples shared by both chart lines: per-bucket min/max
+    # for volume, so the volume spikes the dashboard is about are never
+    # averaged away, and LTTB for the smoother price line.
+    # Returns numpy arrays (datetime64 timestamps, float volumes and prices).
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    volumes = np.asarray(volumes, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if points < 4 or len(timestamps) <= points:
+        return timestamps, volumes, prices
+
+    seconds = timestamps.astype(np.int64) / 1e6
+    keep = np.union1d(minmax_buckets(volumes, points // 4), lttb(seconds, prices, points // 2))
+    return timestamps[keep], volumes[keep], prices[keep]
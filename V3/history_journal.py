@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+from history_store import json_default
+
+
+# Every journal record is a 4-byte big-endian length followed by that many bytes of JSON
+_LENGTH = struct.Struct('>I')
+
+
+class HistoryJournal:
+    # Append-only journal of new samples next to a periodically compacted snapshot.
+    #
+    # append() writes one small length-prefixed record per sample, so the cost
+    # of a tick no longer depends on how much history is held. Once
+    # snapshot_every records have accumulated the caller moves the journal
+    # aside with begin_snapshot(), while no sample is being applied, copies its
+    # state and writes it with write_snapshot(). That goes to a temp file that
+    # is renamed over the old one, and only then is the moved-aside journal
+    # deleted, so samples journaled meanwhile are never lost. On startup the
+    # snapshot is loaded and replay() yields the samples journaled after it.
+
+    def __init__(self, snapshot_path, journal_path=None, snapshot_every=500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + '.journal'
+        self.snapshot_every = snapshot_every
+        self.compacting_path = self.journal_path + '.compacting'
+        self.records_since_snapshot = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()  # held from begin_snapshot() to the end of write_snapshot()
+
+    def append(self, coin, data):
+        # Returns True when it is time to compact into a new snapshot
+        return self.extend(coin, [data])
+
+    def extend(self, coin, samples):
+        # Journals several samples of one coin with a single write and flush
+        chunks = []
+        for data in samples:
+            record = json.dumps([coin, data], default=json_default).encode('utf-8')
+            chunks.append(_LENGTH.pack(len(record)) + record)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, 'ab')
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+            self.records_since_snapshot += len(chunks)
+            return self.records_since_snapshot >= self.snapshot_every
+
+    def begin_snapshot(self, blocking=True):
+        # Starts a new journal; the records so far are kept in compacting_path
+        # until write_snapshot() has stored the state that includes them.
+        # Only one snapshot is written at a time: returns False without doing
+        # anything when another one is in progress and blocking is False.
+        if not self._snapshot_lock.acquire(blocking):
+            return False
+        with self._lock:
+            self.close()
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.compacting_path):
+                    # The previous snapshot was never written, keep its records as well
+                    with open(self.journal_path, 'rb') as src, open(self.compacting_path, 'ab') as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.unlink(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+            self.records_since_snapshot = 0
+        return True
+
+    def write_snapshot(self, state):
+        # Completes the snapshot started by begin_snapshot()
+        try:
+            directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f, default=json_default)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.snapshot_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+
+            # The snapshot now holds everything that was journaled before begin_snapshot()
+            if os.path.exists(self.compacting_path):
+                os.unlink(self.compacting_path)
+        finally:
+            self._snapshot_lock.release()
+
+    def replay(self):
+        # Yields (coin, data) for every complete record, those of a snapshot
+        # that was never finished first. A torn record at the end (crash in
+        # the middle of a write) is cut off so that new records are appended
+        # right after the last good one.
+        for path in (self.compacting_path, self.journal_path):
+            yield from self._replay_file(path)
+
+    def _replay_file(self, path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        torn_at = None
+        with f:
+            while True:
+                offset = f.tell()
+                header = f.read(_LENGTH.size)
+                if not header:
+                    break
+                if len(header) < _LENGTH.size:
+                    torn_at = offset
+                    break
+                (length,) = _LENGTH.unpack(header)
+                record = f.read(length)
+                if len(record) < length:
+                    torn_at = offset
+                    break
+                try:
+                    coin, data = json.loads(record)
+                except ValueError:
+                    logging.warning("Ignoring unreadable record in %s", path)
+                    continue
+                self.records_since_snapshot += 1
+                yield coin, data
+        if torn_at is not None:
+            logging.warning("Dropping truncated record at the end of %s", path)
+            os.truncate(path, torn_at)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,180 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+
+# Default number of samples kept per coin in history['current']
+DEFAULT_DEPTH = 300
+
+# Lookback marks shown on the dashboard, in minutes before now
+LOOKBACK_MARKS = [(30, '-30mins'), (60, '-1hour'), (90, '-1.5hours'), (120, '-2hours'), (720, '-12hours'),
+                  (1440, 'yesterday')]
+
+
+class Sample:
+    # One tick for one coin. Uses __slots__ so that a full ring of samples
+    # costs a fraction of the old six-key dicts.
+    __slots__ = ('timestamp', 'change', 'volume_short', 'direction', 'price', 'volume')
+
+    def __init__(self, timestamp, change, volume_short, direction, price, volume):
+        self.timestamp = timestamp
+        self.change = change
+        self.volume_short = volume_short
+        self.direction = direction
+        self.price = price
+        self.volume = volume
+
+    @classmethod
+    def from_dict(cls, entry):
+        timestamp = entry['timestamp']
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return cls(timestamp, entry.get('change', ''), entry.get('volume_short', ''),
+                   entry.get('direction', ''), entry.get('price'), entry.get('volume', 0))
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    # Dict-style access so templates and older code using entry['volume'] keep working
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f'<Sample {self.timestamp} volume={self.volume} price={self.price}>'
+
+
+class SampleRing:
+    # Fixed-capacity ring buffer of samples. Appending is O(1) and overwrites
+    # the oldest sample once the ring is full. Indexing and iteration are
+    # newest-first, matching the old history['current'] list.
+    __slots__ = ('capacity', '_buf', '_head', '_len')
+
+    def __init__(self, capacity=DEFAULT_DEPTH, samples=()):
+        if capacity < 1:
+            raise ValueError("SampleRing capacity must be at least 1")
+        self.capacity = capacity
+        self._buf = [None] * capacity
+        self._head = 0  # slot the next sample is written to
+        self._len = 0
+        for sample in samples:
+            self.append(sample)
+
+    def append(self, sample):
+        self._buf[self._head] = sample
+        self._head = (self._head + 1) % self.capacity
+        if self._len < self.capacity:
+            self._len += 1
+
+    def clear(self):
+        self._buf = [None] * self.capacity
+        self._head = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __getitem__(self, index):
+        # index 0 is the newest sample
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("SampleRing index out of range")
+        return self._buf[(self._head - 1 - index) % self.capacity]
+
+    def __iter__(self):
+        buf, capacity, head = self._buf, self.capacity, self._head
+        for i in range(1, self._len + 1):
+            yield buf[(head - i) % capacity]
+
+    def oldest_first(self):
+        buf, capacity, start = self._buf, self.capacity, self._head - self._len
+        for i in range(self._len):
+            yield buf[(start + i) % capacity]
+
+    def copy(self):
+        return SampleRing(self.capacity, self.oldest_first())
+
+    def __repr__(self):
+        return f'<SampleRing {self._len}/{self.capacity}>'
+
+
+class TimeIndex:
+    # Per-coin samples kept in timestamp order for lookbacks. Unlike the
+    # SampleRing it is bounded by age, not by count, so marks as far back as
+    # 'yesterday' stay resolvable whatever the tick rate. Lookups are a bisect,
+    # appends and expiry are amortized O(1).
+    __slots__ = ('retention', '_times', '_samples', '_start')
+
+    def __init__(self, retention=timedelta(hours=25)):
+        self.retention = retention
+        self._times = []
+        self._samples = []
+        self._start = 0  # first live position; everything before it has expired
+
+    def append(self, sample):
+        times = self._times
+        timestamp = sample.timestamp
+        if times and timestamp < times[-1]:
+            # Out of order (e.g. replaying saved history), keep the lists sorted
+            position = bisect_right(times, timestamp, self._start)
+            times.insert(position, timestamp)
+            self._samples.insert(position, sample)
+        else:
+            times.append(timestamp)
+            self._samples.append(sample)
+        self._expire(times[-1] - self.retention)
+
+    def _expire(self, cutoff):
+        self._start = bisect_left(self._times, cutoff, self._start)
+        # Drop the expired prefix once it is the larger half of the lists
+        if self._start > 64 and self._start * 2 > len(self._times):
+            del self._times[:self._start]
+            del self._samples[:self._start]
+            self._start = 0
+
+    def nearest_before(self, mark):
+        # Newest sample with timestamp <= mark, or None
+        position = bisect_right(self._times, mark, self._start)
+        if position > self._start:
+            return self._samples[position - 1]
+        return None
+
+    def first_after(self, mark):
+        # Oldest sample with timestamp > mark, or None
+        position = bisect_right(self._times, mark, self._start)
+        if position < len(self._times):
+            return self._samples[position]
+        return None
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+
+def ring_from_entries(entries, capacity=DEFAULT_DEPTH):
+    # entries come newest-first, the same order they are saved in
+    ring = SampleRing(capacity)
+    for entry in reversed(entries[:capacity]):
+        ring.append(entry if isinstance(entry, Sample) else Sample.from_dict(entry))
+    return ring
+
+
+def json_default(obj):
+    # Used as json.dump(default=...) when saving coins_history
+    if isinstance(obj, Sample):
+        return obj.as_dict()
+    if isinstance(obj, SampleRing):
+        return list(obj)
+    return str(obj)
@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+
+
+_STOP = object()
+
+
+class IngestBackedUp(Exception):
+    # Raised by put() when the queue is full, so the handler can answer 503
+    pass
+
+
+class IngestPipeline:
+    # Decouples the update endpoints from applying the updates.
+    #
+    # Handlers validate a request and put() its records (a list, one queue slot
+    # per request) without waiting for anything else. A single consumer thread
+    # takes whatever has queued up, up to max_batch records, and hands it to
+    # apply_batch(records) in arrival order, so a burst of requests is applied
+    # (and persisted) as one batch.
+    #
+    # stats() reports the queue depth and the lag between a record being
+    # queued and being applied; observe_lag(seconds), if given, gets the lag
+    # of every batch.
+
+    def __init__(self, apply_batch, max_pending=10000, max_batch=1000, name='ingest', observe_lag=None):
+        self.apply_batch = apply_batch
+        self.observe_lag = observe_lag
+        self.max_batch = max_batch
+        self.name = name
+        self.records_queued = 0
+        self.records_applied = 0
+        self.records_failed = 0
+        self.batches = 0
+        self.last_lag = 0.0  # seconds the oldest record of the last batch waited
+        self.max_lag = 0.0
+        self._pending_records = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def pending(self):
+        return self._pending_records
+
+    def start(self):
+        # Safe to call more than once, only the first call starts the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-pipeline', daemon=True)
+                self._thread.start()
+
+    def put(self, records):
+        try:
+            self._queue.put_nowait((time.monotonic(), records))
+        except queue.Full:
+            raise IngestBackedUp(f"{self.pending()} records waiting to be applied")
+        with self._lock:
+            self._pending_records += len(records)
+            self.records_queued += len(records)
+
+    def stop(self, timeout=30):
+        # Apply everything queued so far and stop the consumer thread
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"{self.name} pipeline did not drain within {timeout}s, "
+                          f"{self.pending()} records left unapplied")
+
+    def stats(self):
+        return {
+            'depth': self.pending(),
+            'requests_waiting': self._queue.qsize(),
+            'records_queued': self.records_queued,
+            'records_applied': self.records_applied,
+            'records_failed': self.records_failed,
+            'batches': self.batches,
+            'last_lag_seconds': round(self.last_lag, 6),
+            'max_lag_seconds': round(self.max_lag, 6),
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            oldest, records = item
+            batch = list(records)
+            # Coalesce whatever else is already waiting, without waiting for more
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.extend(item[1])
+            self._apply(batch, oldest)
+
+    def _apply(self, batch, oldest):
+        lag = time.monotonic() - oldest
+        try:
+            self.apply_batch(batch)
+            self.records_applied += len(batch)
+        except Exception as e:
+            self.records_failed += len(batch)
+            logging.error(f"Applying {len(batch)} ingested records failed: {e}")
+        with self._lock:
+            self._pending_records -= len(batch)
+        self.batches += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if self.observe_lag is not None:
+            self.observe_lag(lag)
@@ -0,0 +1,100 @@
+import json
+import logging
+import queue
+import threading
+
+
+def sse_event(event, data):
+    # One Server-Sent Events message; json.dumps keeps the data on a single line
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class RowBroadcaster:
+    # Pushes dashboard rows that changed to every /stream subscriber.
+    #
+    # A single background thread calls load_rows() once per interval; it
+    # returns {coin: row html} (the rows are cached in DashboardRows, so this
+    # is mostly dict reads). Rows that differ from what was pushed last are
+    # rendered into one SSE message each and put on every subscriber's queue,
+    # so the cost follows the number of changes, not viewers x refreshes.
+    #
+    # A subscriber whose queue overflows (a stalled client) is dropped; its
+    # stream ends and the browser reconnects and starts from a fresh snapshot.
+
+    def __init__(self, load_rows, interval=1.0, max_queued=256):
+        self.load_rows = load_rows
+        self.interval = interval
+        self.max_queued = max_queued
+        self.messages_sent = 0
+        self._subscribers = set()
+        self._last = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._last = self.load_rows()  # what the first subscriber is about to get as a snapshot
+                self._thread = threading.Thread(target=self._run, name='row-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscribed(self, subscriber):
+        return subscriber in self._subscribers
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._subscribers:
+                continue
+            try:
+                self.push_changes()
+            except Exception as e:
+                logging.error(f"Pushing dashboard rows failed: {e}")
+
+    def push_changes(self):
+        rows = self.load_rows()
+        messages = [sse_event('row', {'coin': coin, 'html': html})
+                    for coin, html in rows.items() if self._last.get(coin) != html]
+        self._last = rows
+        if not messages:
+            return 0
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                for message in messages:
+                    subscriber.put_nowait(message)
+            except queue.Full:
+                logging.warning("Dropping a live dashboard subscriber that is not keeping up")
+                self.unsubscribe(subscriber)
+        self.messages_sent += len(messages) * len(subscribers)
+        return len(messages)
+
+    def stream(self, subscriber, snapshot=(), keepalive=15):
+        # Generator for the streaming response: the snapshot messages, then the
+        # pushed ones, with a comment line every `keepalive` seconds so proxies
+        # keep the connection open and dead clients are noticed
+        try:
+            yield from snapshot
+            while self.subscribed(subscriber):
+                try:
+                    yield subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,280 @@
+# Load generator for /update_coin, for tuning the server without the live scrape.
+#
+#   python loadgen.py synthetic --rate 50 --duration 60            # the coins in coins_list.json
+#   python loadgen.py synthetic --coins 500 --rate 1000 --burstiness 3 --volume-dist pareto
+#   python loadgen.py replay --database sqlite:///instance/coinsNEW.db --speed 60
+#
+# synthetic sends ticks at --rate per second on average. The gaps between
+# ticks are gamma distributed with a coefficient of variation of
+# --burstiness: 0 sends at a steady rate, 1 is a Poisson stream, larger values
+# send in bursts with quiet spells in between. Every coin's volume starts from
+# --volume-dist and then follows a random walk, with an occasional spike.
+#
+# replay sends the stored coin_history rows in timestamp order, --speed times
+# faster than they were recorded.
+#
+# Requests go through one pooled httpx.AsyncClient with at most --concurrency
+# in flight. Progress goes to stderr; the achieved rate, status and error
+# counts and latencies are printed as JSON at the end (or on Ctrl-C).
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_COINS_FILE = os.path.join(HERE, '..', 'coins_list.json')
+
+
+class LoadStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.sent = 0
+        self.completed = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.latencies = []
+        self.max_lag = 0.0  # seconds the sender fell behind the schedule
+
+    def record(self, latency, status=None, error=None):
+        self.completed += 1
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[error] += 1
+        else:
+            self.statuses[status] += 1
+
+    def summary(self, target_rate=None):
+        elapsed = time.monotonic() - self.started
+        ordered = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)] * 1000, 3)
+
+        ok = sum(count for status, count in self.statuses.items() if 200 <= status < 300)
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'sent': self.sent,
+            'completed': self.completed,
+            'ok': ok,
+            'failed': self.completed - ok,
+            'target_rate': target_rate,
+            'achieved_rate': round(self.completed / elapsed, 2) if elapsed else 0.0,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                           'max': percentile(1.0)},
+            'max_lag_seconds': round(self.max_lag, 3),
+        }
+
+
+def load_coin_names(coins, coins_file):
+    if coins:
+        return [f'synthetic{n:04d}' for n in range(coins)]
+    with open(coins_file) as f:
+        return [coin['name'] for coin in json.load(f)]
+
+
+def initial_volume(rng, distribution):
+    if distribution == 'uniform':
+        return rng.uniform(1e5, 1e9)
+    if distribution == 'pareto':
+        return 1e5 * rng.paretovariate(1.2)  # a few coins with huge volume, most small
+    return rng.lognormvariate(math.log(1e7), 2.0)
+
+
+def synthetic_ticks(coins, rate, burstiness, volume_dist, volatility, spike_rate, seed, count=None,
+                    duration=None):
+    # Yields (seconds from the start, /update_coin payload)
+    rng = random.Random(seed)
+    volumes = {coin: initial_volume(rng, volume_dist) for coin in coins}
+    prices = {coin: rng.lognormvariate(0, 3) for coin in coins}
+    mean_gap = 1.0 / rate
+    shape = 1.0 / burstiness ** 2 if burstiness > 0 else None
+    offset = 0.0
+    sent = 0
+    while (count is None or sent < count) and (duration is None or offset < duration):
+        coin = rng.choice(coins)
+        change = rng.gauss(0, volatility)
+        volume = volumes[coin] = volumes[coin] * math.exp(rng.gauss(0, volatility * 2))
+        if rng.random() < spike_rate:
+            volume *= rng.uniform(3, 10)  # not kept: the spike is one tick
+        prices[coin] *= math.exp(change)
+        yield offset, {
+            'name': coin,
+            'volume': f'{volume:,.0f}',
+            'change': f'{change * 100:.2f}%',
+            'direction': 'Increase' if change >= 0 else 'Decrease',
+            'price': f'${prices[coin]:,.6f}',
+        }
+        sent += 1
+        offset += rng.gammavariate(shape, mean_gap / shape) if shape else mean_gap
+
+
+def replay_volume(volume):
+    # REAL since the numeric columns migration; text like '1234.0' before it, sent as stored
+    if isinstance(volume, (int, float)):
+        return f'{volume:,.0f}'
+    return volume or '0'
+
+
+def replay_price(price):
+    # REAL since the numeric columns migration; the scraped '$1,234.56' text before it
+    if isinstance(price, (int, float)):
+        return f'${price:,.6f}'
+    return price or 'Unavailable'
+
+
+def replay_ticks(database_url, speed, since=None, until=None, coin=None):
+    # Yields (seconds from the start, payload) for stored rows, `speed` times faster.
+    # Reads databases from before and after the numeric columns migration.
+    from sqlalchemy import create_engine, text
+
+    query = 'SELECT coin_name, timestamp, volume, change, direction, price FROM coin_history WHERE 1 = 1'
+    params = {}
+    if since:
+        query += ' AND timestamp >= :since'
+        params['since'] = since
+    if until:
+        query += ' AND timestamp <= :until'
+        params['until'] = until
+    if coin:
+        query += ' AND coin_name = :coin'
+        params['coin'] = coin.lower()
+    query += ' ORDER BY timestamp'
+
+    engine = create_engine(database_url)
+    first = None
+    with engine.connect() as connection:
+        for row in connection.execution_options(yield_per=1000).execute(text(query), params):
+            timestamp = row.timestamp
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            if first is None:
+                first = timestamp
+            yield (timestamp - first).total_seconds() / speed, {
+                'name': row.coin_name,
+                'volume': replay_volume(row.volume),
+                'change': row.change or '',
+                'direction': row.direction or '',
+                'price': replay_price(row.price),
+            }
+    engine.dispose()
+
+
+async def send_tick(client, payload, stats, in_flight):
+    started = time.monotonic()
+    try:
+        response = await client.post('/update_coin', json=payload)
+        stats.record(time.monotonic() - started, status=response.status_code)
+    except httpx.HTTPError as e:
+        stats.record(time.monotonic() - started, error=type(e).__name__)
+    finally:
+        in_flight.release()
+
+
+async def report_progress(stats, interval):
+    last_completed = 0
+    while True:
+        await asyncio.sleep(interval)
+        rate = (stats.completed - last_completed) / interval
+        last_completed = stats.completed
+        failed = stats.completed - sum(count for status, count in stats.statuses.items() if 200 <= status < 300)
+        print(f"{stats.completed} sent, {rate:.1f}/s, {failed} failed, lag {stats.max_lag:.2f}s", file=sys.stderr)
+
+
+async def drive(url, ticks, concurrency, timeout, report_every):
+    stats = LoadStats()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+    except NotImplementedError:
+        pass  # no signal handlers on this platform, Ctrl-C ends it without a summary
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = set()
+    reporter = asyncio.create_task(report_progress(stats, report_every)) if report_every else None
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        for offset, payload in ticks:
+            delay = stats.started + offset - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if stop.is_set():
+                break
+            await in_flight.acquire()  # at most `concurrency` requests in flight
+            stats.max_lag = max(stats.max_lag, time.monotonic() - stats.started - offset)
+            stats.sent += 1
+            task = asyncio.create_task(send_tick(client, payload, stats, in_flight))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    if reporter is not None:
+        reporter.cancel()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send synthetic or replayed ticks to /update_coin')
+    parser.add_argument('--url', default=os.environ.get('LOADGEN_URL', 'http://127.0.0.1:5000'))
+    parser.add_argument('--concurrency', type=int, default=32, help='requests in flight at most')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds per request')
+    parser.add_argument('--report-every', type=float, default=5.0, help='seconds between progress lines, 0 for none')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    synthetic = modes.add_parser('synthetic', help='generated ticks')
+    synthetic.add_argument('--coins', type=int, help='number of synthetic coins (default: the coins in --coins-file)')
+    synthetic.add_argument('--coins-file', default=DEFAULT_COINS_FILE)
+    synthetic.add_argument('--rate', type=float, default=10.0, help='ticks per second on average')
+    synthetic.add_argument('--burstiness', type=float, default=1.0,
+                           help='coefficient of variation of the gaps: 0 steady, 1 Poisson, >1 bursty')
+    synthetic.add_argument('--volume-dist', choices=['lognormal', 'uniform', 'pareto'], default='lognormal')
+    synthetic.add_argument('--volatility', type=float, default=0.01, help='per tick standard deviation of the price')
+    synthetic.add_argument('--spike-rate', type=float, default=0.001, help='share of ticks with a volume spike')
+    synthetic.add_argument('--count', type=int, help='stop after this many ticks')
+    synthetic.add_argument('--duration', type=float, help='stop after this many seconds')
+    synthetic.add_argument('--seed', type=int, default=1)
+
+    replay = modes.add_parser('replay', help='stored coin_history rows')
+    replay.add_argument('--database', default=os.environ.get('DATABASE_URL', 'sqlite:///instance/coinsNEW.db'),
+                        help='SQLAlchemy URL of the database to read')
+    replay.add_argument('--speed', type=float, default=60.0, help='replay this many times faster than recorded')
+    replay.add_argument('--since', help='ISO timestamp of the first row')
+    replay.add_argument('--until', help='ISO timestamp of the last row')
+    replay.add_argument('--coin', help='only this coin')
+    args = parser.parse_args()
+
+    if args.mode == 'synthetic':
+        if args.rate <= 0 or args.burstiness < 0:
+            parser.error('--rate must be positive and --burstiness not negative')
+        coins = load_coin_names(args.coins, args.coins_file)
+        ticks = synthetic_ticks(coins, args.rate, args.burstiness, args.volume_dist, args.volatility,
+                                args.spike_rate, args.seed, count=args.count, duration=args.duration)
+        target_rate = args.rate
+    else:
+        if args.speed <= 0:
+            parser.error('--speed must be positive')
+        ticks = replay_ticks(args.database, args.speed, args.since, args.until, args.coin)
+        target_rate = None
+
+    stats = asyncio.run(drive(args.url, ticks, args.concurrency, args.timeout, args.report_every))
+    print(json.dumps(stats.summary(target_rate), indent=2))
+
+
+if __name__ == '__main__':
+    main()
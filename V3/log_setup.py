@@ -0,0 +1,87 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; any other attribute was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+class FieldsFormatter(logging.Formatter):
+    # LOG_FORMAT followed by the record's extra= fields as key=value pairs,
+    # or one JSON object per line when json_lines is set
+
+    def __init__(self, json_lines=False):
+        super().__init__(LOG_FORMAT)
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        if self.json_lines:
+            entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                     'message': record.getMessage()}
+            entry.update(fields)
+            return json.dumps(entry, default=str)
+        text = super().format(record)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return text
+
+
+def configure_logging(level=None):
+    # Sets up the root logger, once per process. Handlers only put records on
+    # a queue; a QueueListener thread formats and writes them, so request and
+    # ingest threads never wait on the terminal or a log file.
+    #
+    # The level is LOG_LEVEL (default INFO) unless given, and LOG_FORMAT=json
+    # switches to JSON lines.
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    root = logging.getLogger()
+    try:
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+    except ValueError:
+        root.setLevel(logging.INFO)
+        logging.warning(f"Unknown log level {level!r}, using INFO")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(FieldsFormatter(json_lines=os.environ.get('LOG_FORMAT', 'text') == 'json'))
+    log_queue = queue.SimpleQueue()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)  # registered first, so it runs last and flushes the shutdown messages
+    return _listener
+
+
+class LogSampler:
+    # For messages logged on every tick: per key, lets the first call and
+    # then one in `every` through, noting how many were skipped. Nothing is
+    # formatted, or counted, while the level is disabled.
+
+    def __init__(self, every=100, logger=None):
+        self.every = every
+        self.logger = logger or logging.getLogger()
+        self._counts = {}
+
+    def log(self, level, key, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if count % self.every:
+            return
+        if count:
+            msg += ' (%d similar messages skipped)'
+            args += (self.every - 1,)
+        self.logger.log(level, msg, *args)
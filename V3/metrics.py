@@ -0,0 +1,144 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds, from 50us (a history update) to 10s (a slow DB commit)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label(name, value):
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{{{name}="{value}"}}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    # Monotonic counter. With a label (e.g. 'coin') it counts per label value.
+    __slots__ = ('name', 'help', 'label', 'value', '_values', '_lock')
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.value = 0
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label_value=None):
+        with self._lock:
+            if self.label is None:
+                self.value += amount
+            else:
+                self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        if self.label is None:
+            lines.append(f'{self.name} {_number(self.value)}')
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+            lines.extend(f'{self.name}{_label(self.label, key)} {_number(value)}' for key, value in values)
+        return lines
+
+
+class Histogram:
+    # Fixed-bucket histogram. The bucket counts and the sum live in arrays
+    # allocated up front, so observe() is a bisection and two in-place adds.
+    __slots__ = ('name', 'help', 'bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self._counts = array('Q', [0] * (len(self.bounds) + 1))  # the last one is +Inf
+        self._sum = array('d', [0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)  # first bucket with value <= bound
+        with self._lock:
+            self._counts[index] += 1
+            self._sum[0] += value
+
+    def render(self):
+        with self._lock:
+            counts = self._counts.tolist()
+            total = self._sum[0]
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_label("le", _number(bound))} {cumulative}')
+        lines.append(f'{self.name}_sum {_number(total)}')
+        lines.append(f'{self.name}_count {cumulative}')
+        return lines
+
+
+class CallbackMetric:
+    # Read from a function at scrape time, for numbers that other objects
+    # already keep (queue depths, cache hits). With a label the function
+    # returns a dict of label value -> number.
+    __slots__ = ('name', 'help', 'function', 'label', 'kind')
+
+    def __init__(self, name, help, function, label=None, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.label = label
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logging.error(f"Reading metric {self.name} failed: {e}")
+            return []
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        if self.label is None:
+            lines.append(f'{self.name} {_number(value)}')
+        else:
+            lines.extend(f'{self.name}{_label(self.label, key)} {_number(number)}'
+                         for key, number in sorted(value.items()))
+        return lines
+
+
+class MetricsRegistry:
+    # The metrics of one process, rendered for a Prometheus scrape by render()
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self._add(Counter(name, help, label))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, function, label=None):
+        return self._add(CallbackMetric(name, help, function, label))
+
+    def counter_function(self, name, help, function, label=None):
+        return self._add(CallbackMetric(name, help, function, label, kind='counter'))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,175 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, case, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+# Bucket widths in seconds, finest first
+RESOLUTIONS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+metadata = MetaData()
+
+# One row per coin, resolution and bucket: OHLC of price, min/max/last of volume
+rollup_table = Table(
+    'coin_rollup', metadata,
+    Column('coin_name', String(50), primary_key=True),
+    Column('resolution', Integer, primary_key=True),  # bucket width in seconds
+    Column('bucket_start', DateTime, primary_key=True),
+    Column('price_open', Float),
+    Column('price_high', Float),
+    Column('price_low', Float),
+    Column('price_close', Float),
+    Column('volume_min', Float),
+    Column('volume_max', Float),
+    Column('volume_last', Float),
+    Column('samples', Integer, nullable=False),
+    Column('last_timestamp', DateTime),  # newest sample folded into the bucket
+)
+
+# The columns of coin_history the rollups are built from
+_history_table = Table(
+    'coin_history', MetaData(),
+    Column('coin_name', String(50)),
+    Column('timestamp', DateTime),
+    Column('volume', Float),
+    Column('price', Float),
+)
+
+
+def bucket_start(timestamp, resolution):
+    seconds = (timestamp - EPOCH) // timedelta(seconds=1)
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def _nullable(function, a, b):
+    # min()/max() of two values where a None side is ignored
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return function(a, b)
+
+
+def _aggregate(rows):
+    # Folds raw coin_history rows into one partial bucket per (coin, resolution, bucket)
+    buckets = {}
+    for row in rows:
+        timestamp, price, volume = row['timestamp'], row['price'], row['volume']
+        for resolution in RESOLUTIONS.values():
+            key = (row['coin_name'], resolution, bucket_start(timestamp, resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = {
+                    'coin_name': key[0], 'resolution': resolution, 'bucket_start': key[2],
+                    'price_open': price, 'price_high': price, 'price_low': price, 'price_close': price,
+                    'volume_min': volume, 'volume_max': volume, 'volume_last': volume,
+                    'samples': 1, 'last_timestamp': timestamp,
+                }
+                continue
+            if bucket['price_open'] is None:
+                bucket['price_open'] = price
+            bucket['price_high'] = _nullable(max, bucket['price_high'], price)
+            bucket['price_low'] = _nullable(min, bucket['price_low'], price)
+            bucket['volume_min'] = _nullable(min, bucket['volume_min'], volume)
+            bucket['volume_max'] = _nullable(max, bucket['volume_max'], volume)
+            if timestamp >= bucket['last_timestamp']:
+                if price is not None:
+                    bucket['price_close'] = price
+                if volume is not None:
+                    bucket['volume_last'] = volume
+                bucket['last_timestamp'] = timestamp
+            bucket['samples'] += 1
+    return list(buckets.values())
+
+
+def _upsert_statement():
+    c = rollup_table.c
+    statement = sqlite_insert(rollup_table)
+    new = statement.excluded
+    newer = new.last_timestamp >= c.last_timestamp
+    return statement.on_conflict_do_update(
+        index_elements=[c.coin_name, c.resolution, c.bucket_start],
+        set_={
+            'price_open': func.coalesce(c.price_open, new.price_open),
+            'price_high': func.max(func.coalesce(c.price_high, new.price_high),
+                                   func.coalesce(new.price_high, c.price_high)),
+            'price_low': func.min(func.coalesce(c.price_low, new.price_low),
+                                  func.coalesce(new.price_low, c.price_low)),
+            'price_close': case((newer, func.coalesce(new.price_close, c.price_close)), else_=c.price_close),
+            'volume_min': func.min(func.coalesce(c.volume_min, new.volume_min),
+                                   func.coalesce(new.volume_min, c.volume_min)),
+            'volume_max': func.max(func.coalesce(c.volume_max, new.volume_max),
+                                   func.coalesce(new.volume_max, c.volume_max)),
+            'volume_last': case((newer, func.coalesce(new.volume_last, c.volume_last)), else_=c.volume_last),
+            'samples': c.samples + new.samples,
+            'last_timestamp': func.max(c.last_timestamp, new.last_timestamp),
+        })
+
+
+def update_rollups(connection, rows):
+    # Folds freshly inserted coin_history rows (dicts with coin_name, timestamp,
+    # volume and price) into every resolution. Call it in the transaction that
+    # inserts the rows so the rollups never disagree with the raw table.
+    buckets = _aggregate(rows)
+    if buckets:
+        connection.execute(_upsert_statement(), buckets)
+
+
+def rebuild_rollups(connection, chunk_size=5000):
+    # Recomputes all rollups from the raw coin_history table
+    started = time.perf_counter()
+    connection.execute(rollup_table.delete())
+    if not inspect(connection).has_table('coin_history'):
+        return 0
+    h = _history_table.c
+    result = connection.execution_options(yield_per=chunk_size).execute(
+        select(h.coin_name, h.timestamp, h.volume, h.price).order_by(h.coin_name, h.timestamp))
+    total = 0
+    for chunk in result.mappings().partitions():
+        update_rollups(connection, chunk)
+        total += len(chunk)
+    logging.info(f"Rebuilt rollups from {total} coin_history rows in {time.perf_counter() - started:.2f}s")
+    return total
+
+
+def choose_resolution(span, points):
+    # Coarsest resolution whose buckets are still no wider than one of `points`
+    # steps across `span`, or None when only the raw samples are precise enough
+    if not points or span is None:
+        return None
+    step = span.total_seconds() / points
+    chosen = None
+    for resolution in RESOLUTIONS.values():
+        if resolution <= step:
+            chosen = resolution
+    return chosen
+
+
+def rollup_series(connection, coin_name, resolution, since=None):
+    # (timestamps, volumes, prices) drawn from the rollup buckets. Each bucket
+    # contributes its lowest and its highest volume, so spikes and dips both
+    # survive, at the bucket start and at its middle, with open/close prices.
+    c = rollup_table.c
+    query = select(c.bucket_start, c.volume_min, c.volume_max, c.price_open, c.price_close).where(
+        c.coin_name == coin_name, c.resolution == resolution)
+    if since is not None:
+        query = query.where(c.bucket_start >= bucket_start(since, resolution))
+    half = timedelta(seconds=resolution / 2)
+    timestamps, volumes, prices = [], [], []
+    rows = connection.execute(query.order_by(c.bucket_start))
+    for start, volume_min, volume_max, price_open, price_close in rows:
+        timestamps += [start, start + half]
+        volumes += [volume_min, volume_max]
+        prices += [price_open, price_close]
+    if not timestamps:
+        return None
+    return timestamps, volumes, prices
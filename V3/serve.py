@@ -0,0 +1,175 @@
+# Production entry point: several worker processes behind one listening socket.
+#
+#   python serve.py --app serverDbCharts --workers 4 --port 5000
+#
+# coins_history lives in exactly one process, the ingest process. It loads the
+# history, runs the DB writer and the scheduler, applies every update and
+# serves them on an internal port. Once a second it publishes the dashboard
+# state (see export_state() in the servers) to a shared memory segment.
+#
+# The reader workers all accept on the public socket. They serve the dashboard
+# and /stream from the published state, the APIs and charts from the DB, and
+# pass every other request (POST /update_coin, /update_coins, and
+# /api/ingest_stats, /metrics) on to the ingest process, so clients never notice the split.
+import argparse
+import http.client
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from flask import Response, request
+from werkzeug.serving import make_server
+
+from snapshot_shm import SnapshotPublisher, SnapshotReader, SnapshotTooLarge
+
+PUBLISH_INTERVAL = 1.0  # seconds between dashboard snapshots
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Reads that only the ingest process can answer. /metrics covers the ingest
+# path; the workers' own chart render timings are not scraped.
+INGEST_ONLY_PATHS = ('/api/ingest_stats', '/metrics')
+NOT_FORWARDED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'server', 'date'}
+
+
+def forward_writes(app, ingest_port, timeout=30):
+    # Installs a before_request hook that proxies every non-read request to the ingest process
+    connections = threading.local()
+
+    def send(method, path, body, headers):
+        connection = getattr(connections, 'connection', None)
+        if connection is None:
+            connection = connections.connection = http.client.HTTPConnection('127.0.0.1', ingest_port,
+                                                                              timeout=timeout)
+        connection.request(method, path, body=body, headers=headers)
+        return connection.getresponse()
+
+    @app.before_request
+    def forward_to_ingest():
+        if request.method in READ_METHODS and request.path not in INGEST_ONLY_PATHS:
+            return None
+        headers = {'Content-Type': request.content_type or 'application/octet-stream'}
+        body = request.get_data()
+        try:
+            try:
+                upstream = send(request.method, request.full_path, body, headers)
+            except (http.client.HTTPException, ConnectionError):
+                # The kept-alive connection was closed by the ingest process, retry on a new one
+                connections.connection = None
+                upstream = send(request.method, request.full_path, body, headers)
+            payload = upstream.read()
+        except OSError as e:
+            connections.connection = None
+            logging.error(f"Forwarding {request.method} {request.path} to the ingest process failed: {e}")
+            return Response('{"error": "Ingest process unavailable"}', status=502, mimetype='application/json')
+        response_headers = [(key, value) for key, value in upstream.getheaders()
+                            if key.lower() not in NOT_FORWARDED_HEADERS]
+        return Response(payload, status=upstream.status, headers=response_headers)
+
+
+def exit_on_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(app_module, listener, snapshot_name, ingest_port):
+    # Entry point of a reader worker process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent shuts the workers down
+    signal.signal(signal.SIGTERM, exit_on_sigterm)  # exit through the finally below
+    server_module = importlib.import_module(app_module)
+    server_module.shared_state = SnapshotReader(snapshot_name)
+    forward_writes(server_module.app, ingest_port)
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, server_module.app, threaded=True, fd=listener.fileno())
+    logging.info(f"Worker {os.getpid()} serving {app_module} on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        # multiprocessing joins the children of a worker before its atexit
+        # handlers run, so the chart render processes have to be let go here
+        renderer = getattr(server_module, 'chart_renderer', None)
+        if renderer is not None:
+            renderer.shutdown()
+
+
+def publish_forever(server_module, publisher, stop):
+    while not stop.wait(PUBLISH_INTERVAL):
+        try:
+            publisher.publish(server_module.export_state())
+        except SnapshotTooLarge as e:
+            logging.error(f"Dashboard snapshot not published: {e}")
+        except Exception as e:
+            logging.error(f"Publishing the dashboard snapshot failed: {e}")
+
+
+def enable_wal(server_module):
+    # Lets the workers read the DB while the ingest process writes to it
+    with server_module.app.app_context():
+        with server_module.db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the dashboard with several worker processes')
+    parser.add_argument('--app', default=os.environ.get('APP_MODULE', 'serverDbCharts'),
+                        help='server module to run (serverV3 or serverDbCharts)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', os.cpu_count() or 2)),
+                        help='number of reader worker processes')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--ingest-port', type=int, default=int(os.environ.get('INGEST_PORT', 5001)),
+                        help='internal port of the ingest process, bound to 127.0.0.1')
+    parser.add_argument('--snapshot-size', type=int, default=16, help='shared memory for the snapshot, in MB')
+    args = parser.parse_args()
+
+    # Imported (and loaded) only here: the ingest process is the one that owns coins_history
+    server_module = importlib.import_module(args.app)
+    server_module.start_services()
+    enable_wal(server_module)
+
+    publisher = SnapshotPublisher(args.snapshot_size * 1024 * 1024)
+    publisher.publish(server_module.export_state())
+    stop = threading.Event()
+    threading.Thread(target=publish_forever, args=(server_module, publisher, stop), daemon=True).start()
+
+    ingest_server = make_server('127.0.0.1', args.ingest_port, server_module.app, threaded=True)
+    threading.Thread(target=ingest_server.serve_forever, daemon=True).start()
+
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    listener.set_inheritable(True)
+    # spawn rather than fork: the ingest process already runs threads
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, name=f'worker-{n}',
+                               args=(args.app, listener, publisher.name, args.ingest_port))
+               for n in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    logging.info(f"Serving {args.app} on {args.host}:{args.port} with {args.workers} workers")
+
+    signal.signal(signal.SIGTERM, stop_on_sigterm)  # shut down cleanly under a process supervisor
+    try:
+        while all(worker.is_alive() for worker in workers):
+            time.sleep(1)
+        logging.error("A worker exited, shutting down")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # a second Ctrl-C must not cut the cleanup short
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join(5)
+        stop.set()
+        ingest_server.shutdown()
+        listener.close()
+        publisher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,51 +3,138 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 import schedule
 import threading
+import atexit
 import time
 import logging
+import os
 from flask_sqlalchemy import SQLAlchemy
 import json
 from flask import jsonify  # Import jsonify for error responses
+from history_store import LOOKBACK_MARKS, Sample, SampleRing, TimeIndex, ring_from_entries
+from volume_windows import VolumeWindows, extreme_entry
+from history_journal import HistoryJournal
+from state_store import CoinStateStore
+from write_behind import WriteBehindQueue, WriterBackedUp
+from ingest_pipeline import IngestPipeline, IngestBackedUp
+from db_migrations import migrate, parse_price
+from dashboard_view import DashboardRows
+from live_updates import RowBroadcaster, sse_event
+from alerts import AlertEngine, TelegramNotifier
+from metrics import CONTENT_TYPE, MetricsRegistry
+from log_setup import LogSampler, configure_logging
+from rollups import RESOLUTIONS, update_rollups, rebuild_rollups, choose_resolution, rollup_series
+from chart_cache import ChartCache
+from chart_render import BrokenProcessPool, ChartRenderer, RendererBusy, render_chart_png
+from downsample import downsample_chart
+from volume_windows import WINDOWS
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import io
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+import uuid
+import numpy as np
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 
 
-# Configure basic logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Log level from LOG_LEVEL (default INFO); records are written by a background thread
+configure_logging()
+tick_log = LogSampler(every=100)  # for the messages logged on every sample
 
 
 COINS_HISTORY_FILE = 'coins_history.txt'  # Define the file path
+COINS_JOURNAL_FILE = 'coins_history.journal'  # New samples since the last snapshot in COINS_HISTORY_FILE
+SNAPSHOT_EVERY = 500  # Journaled samples between two full snapshots
+CURRENT_HISTORY_DEPTH = 300  # Number of recent samples kept per coin in 'current'
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///coinsNEW.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///coinsNEW.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
-
-
-# Initialize the coins_history with additional structure for monthly max/min volume
-coins_history = defaultdict(lambda: {
-    'current': [],
-    'monthly_max_volume': {'volume': 0, 'price': None, 'timestamp': None},
-    'monthly_min_volume': {'volume': float('inf'), 'price': None, 'timestamp': None},
-    '24_hour_max_volume': {'volume': 0, 'price': None, 'timestamp': None},
-    '24_hour_min_volume': {'volume': float('inf'), 'price': None, 'timestamp': None},
+# Timings and counters of the ingest path, exposed at /metrics. The gauges
+# reading the queues and caches are registered next to that route.
+metrics = MetricsRegistry()
+parse_seconds = metrics.histogram('ingest_parse_seconds', 'Time to parse and validate an update request')
+ingest_lag_seconds = metrics.histogram('ingest_queue_lag_seconds',
+                                       'Time records waited in the ingest queue before being applied')
+history_update_seconds = metrics.histogram('history_update_seconds',
+                                           'Time to apply a batch of samples of one coin to coins_history')
+snapshot_seconds = metrics.histogram('history_snapshot_seconds', 'Time to write a full coins_history snapshot')
+db_write_seconds = metrics.histogram('db_write_seconds', 'Time of one batched insert transaction, rollups included')
+samples_ingested = metrics.counter('samples_ingested_total', 'Samples applied to coins_history', label='coin')
+requests_rejected = metrics.counter('ingest_rejected_total', 'Update requests rejected with a full ingest queue')
+chart_render_seconds = metrics.histogram('chart_render_seconds',
+                                         'Time from loading the data of a chart to its rendered PNG')
+
+
+
+# Initialize the coins_history with additional structure for monthly max/min volume.
+# The min/max entries stay None until the coin has a sample inside the window.
+# A coin's history (and its time index and volume windows) is only changed or
+# read while holding coins_history.lock(coin).
+coins_history = CoinStateStore(lambda: {
+    'current': SampleRing(CURRENT_HISTORY_DEPTH),
+    'monthly_max_volume': None,
+    'monthly_min_volume': None,
+    '24_hour_max_volume': None,
+    '24_hour_min_volume': None,
     '-30mins': None, '-1hour': None, '-1.5hours': None, '-2hours': None, '-12hours': None, 'yesterday': None
 })
 
+# Timestamp-ordered samples per coin, covering the oldest lookback mark
+coins_time_index = defaultdict(lambda: TimeIndex(timedelta(minutes=LOOKBACK_MARKS[-1][0] + 60)))
+
+
+def nearest_before(coin, mark):
+    # Newest sample for the coin taken at or before the mark, found by bisection
+    time_index = coins_time_index.get(coin)
+    if time_index is None:
+        return None
+    return time_index.nearest_before(mark)
+
+
+# Sliding 1h/24h/7d/30d volume extremes per coin
+coins_volume_windows = defaultdict(VolumeWindows)
+
+
+def apply_volume_extremes(coin, history, current_time):
+    # Copy the current window extremes into the fields the dashboard reads
+    windows = coins_volume_windows[coin]
+    windows.expire(current_time)
+    extremes = {
+        '24_hour_min_volume': extreme_entry(windows['24h'].min(), current_time),
+        '24_hour_max_volume': extreme_entry(windows['24h'].max(), current_time),
+        'monthly_min_volume': extreme_entry(windows['30d'].min(), current_time),
+        'monthly_max_volume': extreme_entry(windows['30d'].max(), current_time),
+    }
+    # Only re-render the dashboard row when an extreme or its days ago changed
+    if any(history.get(key) != entry for key, entry in extremes.items()):
+        history.update(extremes)
+        dashboard_rows.invalidate(coin)
+
+
+def expire_volume_windows():
+    # Let old extremes age out for coins that stopped receiving samples
+    current_time = datetime.utcnow()
+    for coin in list(coins_volume_windows):
+        with coins_history.lock(coin):
+            apply_volume_extremes(coin, coins_history[coin], current_time)
+
+
+history_journal = HistoryJournal(COINS_HISTORY_FILE, COINS_JOURNAL_FILE, SNAPSHOT_EVERY)
+
 
 def save_coins_history():
-    with open(COINS_HISTORY_FILE, 'w') as f:
-        # Convert the defaultdict to a regular dictionary for JSON serialization
-        data_to_save = {coin: history for coin, history in coins_history.items()}
-        json.dump(data_to_save, f, default=str)  # Use default=str to handle datetime serialization
+    # Write a full snapshot (temp file + rename) and start a new, empty journal.
+    # The copy is taken and the journal switched with every coin locked, so the
+    # snapshot holds exactly the samples journaled before the switch.
+    started = time.perf_counter()
+    with coins_history.all_locked():
+        if not history_journal.begin_snapshot(blocking=False):
+            return  # another thread is writing one; the new samples stay journaled until the next
+        data_to_save = coins_history.snapshot_all()
+    history_journal.write_snapshot(data_to_save)  # Samples become dicts, datetimes become strings
+    snapshot_seconds.observe(time.perf_counter() - started)
 
 
 def load_coins_history():
@@ -56,10 +143,21 @@ def load_coins_history():
             # Load the data from the file
             data_loaded = json.load(f)
 
-            # Convert strings back to datetime objects
+            # Rebuild the ring buffers, converting timestamp strings back to datetime objects
             for coin, history in data_loaded.items():
-                for entry in history['current']:
-                    entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+                history['current'] = ring_from_entries(history['current'], CURRENT_HISTORY_DEPTH)
+                for sample in history['current'].oldest_first():
+                    coins_time_index[coin].append(sample)
+
+                # Seed the volume windows with the saved extremes plus the recent samples;
+                # apply_volume_extremes() expires the ones past their window
+                seeds = [Sample.from_dict(history[key]) for key in ('monthly_max_volume', 'monthly_min_volume',
+                                                                    '24_hour_max_volume', '24_hour_min_volume')
+                         if history.get(key) and history[key].get('timestamp')]
+                seeds.extend(history['current'].oldest_first())
+                for sample in sorted(seeds, key=lambda sample: sample.timestamp):
+                    coins_volume_windows[coin].push(sample)
+                apply_volume_extremes(coin, history, datetime.utcnow())
 
             # Replace the existing coins_history with the loaded data
             coins_history.update(data_loaded)
@@ -69,6 +167,17 @@ def load_coins_history():
     except FileNotFoundError:
         logging.info(f"{COINS_HISTORY_FILE} not found. Starting with an empty coins_history.")
 
+    # Replay the samples journaled after the snapshot was written
+    replayed = 0
+    for coin, data in history_journal.replay():
+        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+        latest = coins_history[coin]['current']
+        if latest and data['timestamp'] <= latest[0].timestamp:
+            continue  # already in the snapshot (crash between snapshot and journal reset)
+        update_history_with_new_data(coin, data, journal=False)
+        replayed += 1
+    logging.info(f"Replayed {replayed} samples from {COINS_JOURNAL_FILE}")
+
 
 
 # Unformat volume for comparisons
@@ -81,74 +190,245 @@ def unformat_volume(volume_str):
     return float(volume_str)
 
 class CoinHistory(db.Model):
+    # Schema changes go through db_migrations.py
+    __table_args__ = (db.Index('ix_coin_history_coin_name_timestamp', 'coin_name', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
     coin_name = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    volume = db.Column(db.String(20))
+    volume = db.Column(db.Float)
     change = db.Column(db.String(20))
     direction = db.Column(db.String(20))
-    price = db.Column(db.String(20))
+    price = db.Column(db.Float)  # USD, parsed from the scraped '$1,234.56' text; None when unavailable
 
     def __repr__(self):
         return f'<CoinHistory {self.coin_name}, Timestamp: {self.timestamp}, Volume: {self.volume}, Change: {self.change}, Direction: {self.direction}, Price: {self.price}>'
 
 
+# Rendered chart PNGs, invalidated per coin whenever new rows for it are committed
+chart_cache = ChartCache(max_bytes=64 * 1024 * 1024)
+
+
+def invalidate_charts(rows):
+    for coin in {row['coin_name'] for row in rows}:
+        chart_cache.invalidate(coin)
+
+
+# CoinHistory rows are inserted in batches by a background thread.
+# Each batch also updates the 1m/5m/1h/1d rollups in the same transaction.
+db_writer = WriteBehindQueue(CoinHistory.__table__, max_batch=500, flush_interval=1.0, max_pending=10000,
+                             in_transaction=update_rollups, observe_write=db_write_seconds.observe, on_flush=invalidate_charts)
+atexit.register(db_writer.stop)  # drain whatever is still queued on shutdown
+
+# Volume alerts, checked for every new sample. They are logged, and sent to
+# Telegram when TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID are set.
+alert_notifier = TelegramNotifier.from_env()
+alert_engine = AlertEngine(alert_notifier.notify if alert_notifier is not None else None)
+if alert_notifier is not None:
+    atexit.register(alert_notifier.stop)
+
 
 
 
-# Formatter function to convert numbers into K, M, B, T
-def human_readable_volume(x, pos):
-    if x >= 1e12:
-        return '{:1.1f}T'.format(x*1e-12)
-    if x >= 1e9:
-        return '{:1.1f}B'.format(x*1e-9)
-    if x >= 1e6:
-        return '{:1.1f}M'.format(x*1e-6)
-    if x >= 1e3:
-        return '{:1.1f}K'.format(x*1e-3)
-    return int(x)
 
+CHART_RANGES = dict(WINDOWS, all=None)  # ?range= values for /charts/<coin_name>
+DEFAULT_CHART_SIZE = (1400, 700)  # pixels, at 100 dpi
 
-def plot_chart(coin_name):
-    data = CoinHistory.query.filter_by(coin_name=coin_name).all()
-    df = pd.DataFrame([{
-        'timestamp': record.timestamp,
-        'price': float(record.price.replace('$', '').replace(',', '')),
-        'volume': float(record.volume.replace(',', ''))
-    } for record in data])
-    df = df.sort_values('timestamp')
 
-    fig, ax1 = plt.subplots(figsize=(14, 7))
+def parse_chart_args(args):
+    # Returns (range name, (width, height), points) from the query string, raises ValueError.
+    # points is how many samples are plotted at most, one per horizontal pixel
+    # by default; points=0 plots every stored sample.
+    chart_range = args.get('range', 'all')
+    if chart_range not in CHART_RANGES:
+        raise ValueError(f"range must be one of {', '.join(CHART_RANGES)}")
+    size = DEFAULT_CHART_SIZE
+    if 'size' in args:
+        width, _, height = args['size'].partition('x')
+        size = (int(width), int(height))
+        if not all(200 <= pixels <= 4000 for pixels in size):
+            raise ValueError("size must be WIDTHxHEIGHT with both between 200 and 4000 pixels")
+    points = int(args.get('points', size[0]))
+    if points != 0 and not 10 <= points <= 100000:
+        raise ValueError("points must be 0 (no downsampling) or between 10 and 100000")
+    return chart_range, size, points
 
-    ax1.set_xlabel('Time')
-    ax1.set_ylabel('Volume', color='tab:blue')
-    ax1.plot(df['timestamp'], df['volume'], color='tab:blue', label='Volume')
-    ax1.tick_params(axis='y', labelcolor='tab:blue')
-    ax1.yaxis.set_major_formatter(ticker.FuncFormatter(human_readable_volume))
-    ax1.legend(loc='upper left')
 
-    ax2 = ax1.twinx()
-    ax2.set_ylabel('Price (USD)', color='tab:red')
-    ax2.plot(df['timestamp'], df['price'], color='tab:red', label='Price')
-    ax2.tick_params(axis='y', labelcolor='tab:red')
-    ax2.legend(loc='upper right')
+def chart_time_bucket(chart_range, points):
+    # The step of the range's resolution that now falls in, or None for
+    # range=all. A bounded range slides with the clock even when no rows are
+    # stored, so its cached charts and ETags only hold until the next step.
+    span = CHART_RANGES[chart_range]
+    if span is None:
+        return None
+    resolution = choose_resolution(span, points) or RESOLUTIONS['1m']
+    return int(time.time() // resolution)
 
-    plt.title(f'Volume and Price Over Time for {coin_name.capitalize()}')
-    fig.tight_layout()
 
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    plt.close(fig)
-    buffer.seek(0)
-    return buffer
+def chart_data(coin_name, chart_range='all', points=0):
+    # (timestamps, volumes, prices) of the coin in time order, or None without rows.
+    # When `points` samples are enough, they come from the coarsest rollup
+    # resolution that still has at least that many buckets across the range.
+    since = None
+    if CHART_RANGES[chart_range] is not None:
+        since = datetime.utcnow() - CHART_RANGES[chart_range]
+    if points:
+        first = since or db.session.execute(
+            db.select(db.func.min(CoinHistory.timestamp)).where(CoinHistory.coin_name == coin_name)).scalar()
+        resolution = choose_resolution(datetime.utcnow() - first, points) if first else None
+        if resolution is not None:
+            series = rollup_series(db.session.connection(), coin_name, resolution, since)
+            if series is not None:
+                return series
+
+    query = db.select(CoinHistory.timestamp, CoinHistory.volume, CoinHistory.price).where(
+        CoinHistory.coin_name == coin_name)
+    if since is not None:
+        query = query.where(CoinHistory.timestamp >= since)
+    rows = db.session.execute(query.order_by(CoinHistory.timestamp)).all()
+    if not rows:
+        return None
+    timestamps, volumes, prices = zip(*rows)
+    return list(timestamps), list(volumes), list(prices)
+
+
+def plot_chart(coin_name, chart_range='all', size=DEFAULT_CHART_SIZE, points=DEFAULT_CHART_SIZE[0]):
+    # Renders in the calling thread; requests go through chart_renderer instead
+    data = chart_data(coin_name, chart_range, points)
+    if data is None:
+        return None
+    if points:
+        data = downsample_chart(*data, points)
+    return io.BytesIO(render_chart_png(coin_name, *data, size))
+
+
+def store_rendered_chart(key, tag, png):
+    version, started = tag
+    chart_render_seconds.observe(time.perf_counter() - started)
+    chart_cache.put(key, png, version)
+
+
+CHART_RENDER_TIMEOUT = 30  # seconds a request waits for a render without a stale image to fall back on
+CHART_STALE_WAIT = 1  # seconds a request waits for a re-render before serving the stale image
+chart_renderer = ChartRenderer(max_workers=2, max_pending=16, on_done=store_rendered_chart)
+
+
+def chart_response(entry, stale=False):
+    # This setup is for inline display; it doesn't prompt for download
+    response = send_file(io.BytesIO(entry.png), mimetype='image/png', etag=entry.etag,
+                         last_modified=entry.last_modified, conditional=True)
+    response.cache_control.no_cache = True  # always revalidate, a 304 costs nothing
+    if stale:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
 
 
 @app.route('/charts/<coin_name>')
 def show_chart(coin_name):
-    buffer = plot_chart(coin_name)
-    buffer.seek(0)  # Reset the buffer's position to the start
-    # This setup is for inline display; it doesn't prompt for download
-    return send_file(buffer, mimetype='image/png')
+    follow_shared_charts()
+    try:
+        chart_range, size, points = parse_chart_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    # Charts only change when new samples for the coin are stored, so repeat
+    # views are served from the cache and browsers revalidate with ETag/Last-Modified
+    bucket = chart_time_bucket(chart_range, points)
+    key = (coin_name, chart_range, size, points, bucket)
+    entry = chart_cache.get(key)
+    if entry is not None:
+        return chart_response(entry)
+
+    def load_data():
+        started = time.perf_counter()
+        version = chart_cache.version(coin_name)  # read before the query, see ChartCache.put
+        data = chart_data(coin_name, chart_range, points)
+        if data is None:
+            return None
+        if points:
+            # Far fewer points to pickle to the worker and for matplotlib to draw
+            data = downsample_chart(*data, points)
+        return (version, started), (coin_name, *data, size)
+
+    # Render in the worker pool. Concurrent requests for the same chart share
+    # one render; while it runs, an outdated image is better than a long wait.
+    stale = chart_cache.peek(key)
+    if stale is None and bucket is not None:
+        stale = chart_cache.peek((coin_name, chart_range, size, points, bucket - 1))  # the previous step's chart
+    try:
+        future = chart_renderer.render(key, load_data)
+        png = future.result(timeout=CHART_STALE_WAIT if stale else CHART_RENDER_TIMEOUT)
+    except (FutureTimeoutError, RendererBusy, BrokenProcessPool) as e:
+        # A broken pool has been dropped by chart_renderer, the retry renders in a new one
+        if stale is not None:
+            return chart_response(stale, stale=True)
+        logging.error(f"Chart {key} not ready: {e!r}")
+        return jsonify(error="Chart is still rendering, retry later"), 503, {'Retry-After': '5'}
+    if png is None:
+        return jsonify(error=f"No data for {coin_name}"), 404
+
+    entry = chart_cache.peek(key)
+    if entry is None:  # too big for the cache
+        entry = chart_cache.put(key, png, chart_cache.version(coin_name))
+    return chart_response(entry)
+
+
+@app.route('/charts/<coin_name>/view')
+def show_chart_view(coin_name):
+    # Interactive chart drawn in the browser from /api/charts/<coin_name>
+    return render_template('chart_display.html', coin_name=coin_name, ranges=list(CHART_RANGES))
+
+
+# Part of every chart-data ETag, so ETags from before a restart never match
+CHART_ETAG_SALT = uuid.uuid4().hex[:8]
+
+
+@app.route('/api/charts/<coin_name>')
+def chart_data_api(coin_name):
+    # Columnar chart data for client-side rendering:
+    #   {"coin", "range", "t": [epoch seconds], "volume": [...], "price": [...]}
+    # Takes the same range= and points= parameters as /charts/<coin_name>.
+    follow_shared_charts()
+    try:
+        chart_range, _, points = parse_chart_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    # The coin's chart version only changes when new rows are committed, and
+    # the time bucket when a bounded range has moved on by a step, so a
+    # revalidating browser gets its 304 without any query being run
+    etag = f'{CHART_ETAG_SALT}-{chart_cache.version(coin_name)}-{chart_range}-{points}'
+    bucket = chart_time_bucket(chart_range, points)
+    if bucket is not None:
+        etag += f'-{bucket}'
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    data = chart_data(coin_name, chart_range, points)
+    if data is None:
+        return jsonify(error=f"No data for {coin_name}"), 404
+    if points:
+        data = downsample_chart(*data, points)
+    timestamps, volumes, prices = (np.asarray(column) for column in data)
+
+    def nullable(values):
+        # JSON has no NaN; missing values (price 'Unavailable') become null
+        values = values.astype(np.float64)
+        return [None if value != value else value for value in values.tolist()]
+
+    response = jsonify({
+        'coin': coin_name,
+        'range': chart_range,
+        't': timestamps.astype('datetime64[s]').astype(np.int64).tolist(),
+        'volume': nullable(volumes),
+        'price': nullable(prices),
+    })
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/charts')
@@ -158,61 +438,60 @@ def show_coins():
 
 
 
-def update_history_with_new_data(coin, data):
+def update_history_with_new_data(coin, data, journal=True):
     if coin is None or data is None:
         logging.info("Skipping update due to None coin or data.")
         return
+    update_history_with_new_samples(coin, [data], journal)
 
-    logging.debug(f"Updating history for coin: {coin}")
 
+def update_history_with_new_samples(coin, samples, journal=True):
+    # Applies one or more samples of a coin, oldest first. The lookbacks,
+    # extremes and dashboard row are worked out once for all of them, and they
+    # are journaled with a single write.
+    started = time.perf_counter()
     current_time = datetime.utcnow()
-    history = coins_history[coin]
-
-    # Insert new data at the beginning of the 'current' list
-    history['current'].insert(0, {
-        'timestamp': data['timestamp'],
-        'change': data['change'],
-        'volume_short': format_volume(data['volume']),
-        'direction': data['direction'],
-        'price': data['price'],
-        'volume': data['volume']
-    })
-
-    # Keep only the 100 most recent entries for 'current'
-    history['current'] = history['current'][:300]
-
-    # Calculate days ago for monthly max/min
-    def calculate_days_ago(timestamp):
-        return (current_time.date() - timestamp.date()).days
-
-    # Update historical intervals and monthly min/max volumes
-    for minutes, key in zip([30, 60, 90, 120, 720, 1440], ['-30mins', '-1hour', '-1.5hours', '-2hours', '-12hours', 'yesterday']):
-        mark = current_time - timedelta(minutes=minutes)
-        past_entries = [entry for entry in history['current'] if entry['timestamp'] <= mark]
-        closest_entry = min(past_entries, key=lambda entry: abs((entry['timestamp'] - mark).total_seconds()), default=None)
-        history[key] = closest_entry
-
-    # Update 24-hour and monthly min/max volumes
-    recent_entries = [entry for entry in history['current'] if current_time - entry['timestamp'] <= timedelta(days=1)]
-    if recent_entries:
-        volumes = [entry['volume'] for entry in recent_entries]
-        min_volume_entry = min(recent_entries, key=lambda entry: entry['volume'])
-        max_volume_entry = max(recent_entries, key=lambda entry: entry['volume'])
-
-        history['24_hour_min_volume'] = min_volume_entry
-        history['24_hour_max_volume'] = max_volume_entry
-
-        # Check and update monthly volumes if necessary
-        if min_volume_entry['volume'] < history['monthly_min_volume'].get('volume', float('inf')):
-            history['monthly_min_volume'] = min_volume_entry
-            history['monthly_min_volume']['days_ago'] = calculate_days_ago(min_volume_entry['timestamp'])
-
-        if max_volume_entry['volume'] > history['monthly_max_volume'].get('volume', 0):
-            history['monthly_max_volume'] = max_volume_entry
-            history['monthly_max_volume']['days_ago'] = calculate_days_ago(max_volume_entry['timestamp'])
-
-    save_coins_history()
-    logging.debug(f"Updated history for coin: {coin}")
+    compact = False
+    with coins_history.lock(coin):
+        history = coins_history[coin]
+
+        # Push the new samples into the ring; the last becomes history['current'][0] and
+        # the oldest samples drop out once CURRENT_HISTORY_DEPTH is reached
+        added = []
+        for data in samples:
+            sample = Sample(
+                data['timestamp'],
+                data['change'],
+                format_volume(data['volume']),
+                data['direction'],
+                data['price'],
+                data['volume']
+            )
+            history['current'].append(sample)
+            coins_time_index[coin].append(sample)
+            coins_volume_windows[coin].push(sample)
+            added.append(sample)
+
+        # Update historical intervals
+        for minutes, key in LOOKBACK_MARKS:
+            history[key] = nearest_before(coin, current_time - timedelta(minutes=minutes))
+
+        # Update 24-hour and monthly min/max volumes from the sliding windows
+        apply_volume_extremes(coin, history, current_time)
+
+        # Replayed samples (journal=False) were alerted on when they first arrived
+        if journal:
+            alert_engine.evaluate(coin, added, history, coins_volume_windows[coin])
+
+        # Only the new samples are written per tick, the full state every SNAPSHOT_EVERY samples.
+        # Journaled under the lock, so a snapshot never misses a sample it has already applied.
+        if journal:
+            compact = history_journal.extend(coin, samples)
+    dashboard_rows.invalidate(coin)
+    history_update_seconds.observe(time.perf_counter() - started)
+    if compact:
+        save_coins_history()  # takes every coin's lock, so not while holding this one
+    tick_log.log(logging.DEBUG, coin, "Updated history for coin: %s with %d samples", coin, len(samples))
 
 
 
@@ -249,95 +528,163 @@ def get_time_key(time_diff):
 
 
 def sync_file_data_with_db():
+    # Make sure every sample loaded from COINS_HISTORY_FILE and its journal is in
+    # the DB (the write-behind queue may not have flushed before a crash). The
+    # stored timestamps come from one indexed range query per coin, and all the
+    # missing rows go in with a single bulk insert.
+    started = time.perf_counter()
+    checked = 0
+    missing_rows = []
     try:
-        with open(COINS_HISTORY_FILE, 'r') as f:
-            data_loaded = json.load(f)
-            for coin, history_list in data_loaded.items():
-                for entry in history_list.get('current', []):  # Assuming 'current' holds the relevant entries
-                    # Parse the timestamp string to a datetime object
-                    timestamp = datetime.fromisoformat(entry['timestamp'])
-                    # Check if this entry already exists in the DB
-                    exists = CoinHistory.query.filter_by(coin_name=coin, timestamp=timestamp).first()
-                    if not exists:
-                        # Entry does not exist, so we insert it
-                        new_entry = CoinHistory(
-                            coin_name=coin,
-                            timestamp=timestamp,
-                            volume=entry['volume'],
-                            change=entry['change'],
-                            direction=entry['direction'],
-                            price=entry['price']
-                        )
-                        db.session.add(new_entry)
+        for coin, history in coins_history.items():
+            with coins_history.lock(coin):
+                samples = list(history['current'])
+            if not samples:
+                continue
+            checked += len(samples)
+            stored = set(db.session.execute(
+                db.select(CoinHistory.timestamp).where(
+                    CoinHistory.coin_name == coin,
+                    CoinHistory.timestamp.between(samples[-1].timestamp, samples[0].timestamp))
+            ).scalars())
+            missing_rows.extend({
+                'coin_name': coin,
+                'timestamp': sample.timestamp,
+                'volume': sample.volume,
+                'change': sample.change,
+                'direction': sample.direction,
+                'price': parse_price(sample.price)
+            } for sample in samples if sample.timestamp not in stored)
+
+        if missing_rows:
+            db.session.execute(CoinHistory.__table__.insert(), missing_rows)
+            update_rollups(db.session.connection(), missing_rows)
             db.session.commit()
-    except FileNotFoundError:
-        logging.info(f"{COINS_HISTORY_FILE} not found. No data to sync with DB.")
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Error syncing file data with DB: {str(e)}")
+        return
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    logging.info(f"Synced file data with DB: checked {checked} samples, inserted {len(missing_rows)} "
+                 f"in {elapsed:.3f}s ({checked / elapsed:.0f} rows/s)")
 
 
 
 @app.route('/')
 def index():
-    current_time = datetime.utcnow()
-    prepared_data = {}
-
-    # Initialize the time slots for each coin, including monthly max and min
-    time_keys = ['current', '-30mins', '-1hour', '-1.5hours', '-2hours', '-12hours', 'yesterday', 'monthly_max_volume',
-                 'monthly_min_volume']
-    for coin, history in coins_history.items():
-        prepared_history = {k: history.get(k, None) for k in time_keys}
-
-        # Process 'current' data and find closest to 30 minutes mark if not already processed
-        current_data_list = prepared_history.get('current', [])
-        if current_data_list:
-            thirty_min_mark = current_time - timedelta(minutes=30)
-            closest_to_thirty_min = min(current_data_list,
-                                        key=lambda x: abs((x['timestamp'] - thirty_min_mark).total_seconds()),
-                                        default=None)
-            prepared_history['-30mins'] = closest_to_thirty_min or prepared_history.get('-30mins')
-
-        # Format min and max 24-hour volumes for display
-        prepared_history['Min 24h/V'] = format_volume(
-            history.get('24_hour_min_volume', {'volume': float('inf')})['volume'])
-        prepared_history['Max 24h/V'] = format_volume(history.get('24_hour_max_volume', {'volume': 0})['volume'])
-
-        # Update days ago for monthly volumes
-        if history.get('monthly_max_volume'):
-            timestamp_max = history['monthly_max_volume']['timestamp']
-            # Check if the timestamp is a string, and parse it if so
-            if isinstance(timestamp_max, str):
-                timestamp_max = datetime.fromisoformat(timestamp_max)
-            prepared_history['monthly_max_volume']['days_ago'] = (current_time.date() - timestamp_max.date()).days
-
-        if history.get('monthly_min_volume'):
-            timestamp_min = history['monthly_min_volume']['timestamp']
-            # Check if the timestamp is a string, and parse it if so
-            if isinstance(timestamp_min, str):
-                timestamp_min = datetime.fromisoformat(timestamp_min)
-            prepared_history['monthly_min_volume']['days_ago'] = (current_time.date() - timestamp_min.date()).days
-
-        prepared_data[coin] = prepared_history
-
-    return render_template('index.html', coins_history=prepared_data, current_time=current_time,
+    # Only rows of coins that changed (or whose "mins ago" moved on) are rendered again
+    rows = current_dashboard_rows()
+    return render_template('index.html', rows=rows.values())
+
+
+DASHBOARD_KEYS = ['current', '-30mins', '-1hour', '-1.5hours', '-2hours', '-12hours', 'yesterday',
+                  'monthly_max_volume', 'monthly_min_volume']
+
+
+def build_dashboard_row(coin, current_time):
+    # Renders the coin's dashboard row and works out until when it stays valid
+    expires = [datetime.max]
+    thirty_min_mark = current_time - timedelta(minutes=30)
+    with coins_history.lock(coin):
+        history = coins_history[coin]
+        prepared_history = {k: history.get(k, None) for k in DASHBOARD_KEYS}
+        prepared_history['current'] = history['current'][:1]  # the row only shows the newest sample
+
+        # Refresh the 30 minutes mark, it moves on even when the coin gets no new samples
+        prepared_history['-30mins'] = nearest_before(coin, thirty_min_mark) or prepared_history.get('-30mins')
+        time_index = coins_time_index.get(coin)
+        following = time_index.first_after(thirty_min_mark) if time_index is not None else None
+        min_24h, max_24h = history.get('24_hour_min_volume'), history.get('24_hour_max_volume')
+    if following is not None:
+        expires.append(following.timestamp + timedelta(minutes=30))
+
+    # The "mins ago" of the current sample changes once a minute
+    if prepared_history['current']:
+        latest = prepared_history['current'][0]['timestamp']
+        minutes_ago = (current_time - latest) // timedelta(minutes=1)
+        expires.append(latest + timedelta(minutes=minutes_ago + 1))
+
+    # Format min and max 24-hour volumes for display
+    prepared_history['Min 24h/V'] = format_volume(min_24h['volume']) if min_24h else 'N/A'
+    prepared_history['Max 24h/V'] = format_volume(max_24h['volume']) if max_24h else 'N/A'
+
+    # days_ago of the monthly extremes is kept current by apply_volume_extremes
+    html = render_template('index_row.html', coin=coin, history=prepared_history, current_time=current_time,
                            format_volume=format_volume)
+    return html, min(expires)
 
 
+dashboard_rows = DashboardRows(build_dashboard_row)
 
 
-@app.route('/update_coin', methods=['POST'])
-def update_coin():
-    coin_info = request.json
+# In the reader workers of serve.py, a SnapshotReader of what the ingest
+# process publishes with export_state(); their own coins_history stays empty
+shared_state = None
+
+
+def current_dashboard_rows():
+    # {coin: row html}, also called by the broadcaster thread outside of any request
+    if shared_state is not None:
+        state = shared_state.get()
+        return state['rows'] if state is not None else {}
+    with app.app_context():
+        coins = list(coins_history)
+        return dict(zip(coins, dashboard_rows.rows(coins, datetime.utcnow())))
+
+
+def export_state():
+    # What the ingest process of serve.py publishes to its reader workers
+    return {
+        'rows': current_dashboard_rows(),
+        'chart_versions': chart_cache.versions(),
+        'chart_etag_salt': CHART_ETAG_SALT,
+    }
+
+
+def follow_shared_charts():
+    # In a serve.py reader worker, charts go stale when the ingest process stores rows
+    global CHART_ETAG_SALT
+    if shared_state is None:
+        return
+    state = shared_state.get()
+    if state is not None:
+        chart_cache.sync_versions(state['chart_versions'])
+        CHART_ETAG_SALT = state['chart_etag_salt']
+
+
+# Pushes the rows that changed to the dashboards subscribed to /stream
+row_broadcaster = RowBroadcaster(current_dashboard_rows, interval=1.0)
+
+
+@app.route('/stream')
+def stream():
+    # Server-Sent Events: one "row" event per coin to start with, then one for
+    # every row that renders differently, e.g. after a new sample
+    subscriber = row_broadcaster.subscribe()  # before the snapshot, so no change falls in between
+    rows = current_dashboard_rows()
+    snapshot = [sse_event('row', {'coin': coin, 'html': html}) for coin, html in rows.items()]
+    response = app.response_class(row_broadcaster.stream(subscriber, snapshot), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+
+def parse_coin_info(coin_info):
+    # Validates one incoming coin record and returns (coin_name, history data, DB row).
+    # Raises ValueError with a message for the client when the record is unusable.
+    if not isinstance(coin_info, dict) or not isinstance(coin_info.get('name'), str) or not coin_info['name']:
+        raise ValueError("Missing coin name")
     coin_name = coin_info['name'].lower()
 
-    volume_str = coin_info.get('volume', "0").replace(',', '')
+    volume_str = str(coin_info.get('volume', "0")).replace(',', '')
     try:
         volume = float(volume_str)
     except ValueError as e:
         logging.error(f"Error converting volume to float: {e}")
-        return jsonify(error="Error processing volume"), 400
+        raise ValueError("Error processing volume")
 
-    logging.debug(f"Received coin info: {coin_info}, volume: {volume}")
+    tick_log.log(logging.DEBUG, 'received', "Received coin info: %s, volume: %s", coin_info, volume)
 
     coin_data_for_history = {
         'timestamp': datetime.utcnow(),
@@ -347,46 +694,253 @@ def update_coin():
         'price': coin_info.get('price', 'Unavailable'),
         'volume': volume
     }
+    db_row = {
+        'coin_name': coin_name,
+        'timestamp': coin_data_for_history['timestamp'],
+        'volume': volume,
+        'change': coin_data_for_history['change'],
+        'direction': coin_data_for_history['direction'],
+        'price': parse_price(coin_data_for_history['price'])
+    }
+    return coin_name, coin_data_for_history, db_row
+
+
+def apply_ingested(records):
+    # Consumer of ingest_pipeline: (coin_name, history data, DB row) records in arrival order
+    dropped = 0
+    for _, _, db_row in records:
+        while True:
+            try:
+                db_writer.put(db_row)
+                break
+            except WriterBackedUp as e:
+                if not db_writer.running:
+                    # The writer thread died or was stopped, waiting would stall ingest for good
+                    db_writer.discard()
+                    dropped += 1
+                    break
+                # Leave the records queued, so the endpoints push back with 503s
+                logging.error(f"DB writer is backed up, waiting to apply ingested records: {e}")
+    if dropped:
+        logging.error(f"DB writer is not running, dropped {dropped} ingested rows (history is still updated)")
+
+    samples_by_coin = defaultdict(list)
+    for coin_name, coin_data_for_history, _ in records:
+        samples_by_coin[coin_name].append(coin_data_for_history)
+    for coin_name, samples in samples_by_coin.items():
+        update_history_with_new_samples(coin_name, samples)
+        samples_ingested.inc(len(samples), coin_name)
+
+
+# The update endpoints only validate and enqueue; one thread applies the
+# records in order, a burst at a time
+ingest_pipeline = IngestPipeline(apply_ingested, max_pending=10000, max_batch=1000,
+                                 observe_lag=ingest_lag_seconds.observe)
+atexit.register(ingest_pipeline.stop)  # registered after db_writer.stop, so it runs (and drains) first
+
+
+def enqueue_ingested(records):
+    # Returns an error response when the pipeline is full, None once queued
+    db_writer.start(db.engine)
+    ingest_pipeline.start()
+    try:
+        ingest_pipeline.put(records)
+    except IngestBackedUp as e:
+        requests_rejected.inc()
+        logging.error(f"Rejecting coin data, ingest queue is full: {e}")
+        return jsonify(error="Ingest queue is full, retry later"), 503
+    return None
 
-    update_history_with_new_data(coin_name, coin_data_for_history)
 
+@app.route('/update_coin', methods=['POST'])
+def update_coin():
+    started = time.perf_counter()
     try:
-        new_coin_history_entry = CoinHistory(
-            coin_name=coin_name,
-            timestamp=coin_data_for_history['timestamp'],
-            volume=volume_str,
-            change=coin_data_for_history['change'],
-            direction=coin_data_for_history['direction'],
-            price=coin_data_for_history['price']
-        )
-        db.session.add(new_coin_history_entry)
-        db.session.commit()
-        logging.info(f"Persisted to DB: {new_coin_history_entry}")
-    except Exception as e:
-        logging.error(f"Failed to insert coin data into DB: {e}")
-        db.session.rollback()
-        return jsonify(error="Database insertion failed"), 500
+        record = parse_coin_info(request.json)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    parse_seconds.observe(time.perf_counter() - started)
 
+    rejected = enqueue_ingested([record])
+    if rejected is not None:
+        return rejected
     return '', 204
 
+
+@app.route('/update_coins', methods=['POST'])
+def update_coins():
+    # Batch version of /update_coin for a whole scrape cycle. Takes a JSON array
+    # of coin records, or NDJSON (one record per line) with Content-Type
+    # application/x-ndjson. Valid records are queued together and every
+    # record gets its own status in the response.
+    started = time.perf_counter()
+    invalid_json = object()  # stands in for an NDJSON line that doesn't parse
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(invalid_json)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify(error="Expected a JSON array of coin records"), 400
+
+    results = []
+    accepted = []
+    for index, coin_info in enumerate(records):
+        if coin_info is invalid_json:
+            results.append({'index': index, 'status': 'error', 'error': 'Invalid JSON'})
+            continue
+        try:
+            coin_name, coin_data_for_history, db_row = parse_coin_info(coin_info)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+        accepted.append((coin_name, coin_data_for_history, db_row))
+        results.append({'index': index, 'name': coin_name, 'status': 'ok'})
+    parse_seconds.observe(time.perf_counter() - started)
+
+    if not accepted:
+        return jsonify(accepted=0, rejected=len(results), results=results), 400
+
+    rejected = enqueue_ingested(accepted)
+    if rejected is not None:
+        return rejected
+    return jsonify(accepted=len(accepted), rejected=len(results) - len(accepted), results=results)
+
+
+@app.route('/api/ingest_stats')
+def ingest_stats():
+    # Depth and lag of the ingest pipeline and of the DB writer behind it
+    stats = ingest_pipeline.stats()
+    stats['db_writer'] = {
+        'depth': db_writer.pending(),
+        'rows_written': db_writer.rows_written,
+        'rows_dropped': db_writer.rows_dropped,
+    }
+    return jsonify(stats)
+
+
+metrics.gauge('ingest_queue_depth', 'Records waiting in the ingest queue', ingest_pipeline.pending)
+metrics.gauge('db_writer_queue_depth', 'Rows waiting for the DB writer', db_writer.pending)
+metrics.counter_function('db_rows_written_total', 'Rows inserted by the DB writer', lambda: db_writer.rows_written)
+metrics.counter_function('db_rows_dropped_total', 'Rows the DB writer gave up on', lambda: db_writer.rows_dropped)
+metrics.counter_function('dashboard_row_cache_hits_total', 'Dashboard rows served from the cache',
+                         lambda: dashboard_rows.hits)
+metrics.counter_function('dashboard_row_cache_misses_total', 'Dashboard rows rendered', lambda: dashboard_rows.misses)
+metrics.gauge('sse_subscribers', 'Open /stream connections', lambda: len(row_broadcaster))
+metrics.counter_function('alerts_fired_total', 'Volume alerts raised', lambda: alert_engine.alerts_fired)
+metrics.counter_function('alerts_suppressed_total', 'Volume alerts dropped as duplicates',
+                         lambda: alert_engine.alerts_suppressed)
+if alert_notifier is not None:
+    metrics.counter_function('telegram_messages_total', 'Alerts handed to Telegram, by outcome',
+                             lambda: {key: value for key, value in alert_notifier.stats().items() if key != 'pending'},
+                             label='outcome')
+metrics.counter_function('chart_cache_hits_total', 'Chart requests served from the PNG cache',
+                         lambda: chart_cache.hits)
+metrics.counter_function('chart_cache_misses_total', 'Chart requests that needed a render',
+                         lambda: chart_cache.misses)
+metrics.gauge('chart_renders_in_flight', 'Charts queued or rendering in the worker pool', chart_renderer.pending)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus scrape endpoint
+    return app.response_class(metrics.render(), content_type=CONTENT_TYPE)
+
+
+COIN_HISTORY_FIELDS = ('id', 'coin_name', 'timestamp', 'volume', 'change', 'direction', 'price')
+API_PAGE_SIZE = 1000  # Rows per page of /api/coin_history when no limit is given
+API_MAX_PAGE_SIZE = 10000
+
+
+def coin_history_row(row):
+    # JSON-ready dict for one selected row
+    data = row._asdict()
+    if data.get('timestamp') is not None:
+        data['timestamp'] = data['timestamp'].isoformat()
+    return data
+
+
 @app.route('/api/coin_history')
 def coin_history_api():
-    coin_histories = CoinHistory.query.all()
-    return jsonify([{
-        'id': history.id,
-        'coin_name': history.coin_name,
-        'timestamp': history.timestamp.isoformat(),
-        'volume': history.volume,
-        'change': history.change,
-        'direction': history.direction,
-        'price': history.price
-    } for history in coin_histories])
-
+    # Query parameters:
+    #   coin              only rows for this coin
+    #   since, until      ISO timestamps bounding the rows (inclusive)
+    #   after_id, limit   keyset pagination: rows with id > after_id, at most limit of them.
+    #                     The id to continue from is sent in the X-Next-After-Id header.
+    #   fields            comma separated subset of COIN_HISTORY_FIELDS
+    #   format=ndjson     stream every matching row as NDJSON instead of one JSON page
+    args = request.args
+    try:
+        fields = [field for field in args.get('fields', ','.join(COIN_HISTORY_FIELDS)).split(',') if field]
+        unknown = set(fields) - set(COIN_HISTORY_FIELDS)
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else "No fields requested")
+        after_id = int(args.get('after_id', 0))
+        since = datetime.fromisoformat(args['since']) if 'since' in args else None
+        until = datetime.fromisoformat(args['until']) if 'until' in args else None
+        limit = int(args['limit']) if 'limit' in args else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    columns = CoinHistory.__table__.c
+    selected = [columns[field] for field in fields]
+    if 'id' not in fields:
+        selected.append(columns.id)  # needed for the keyset cursor
+    query = db.select(*selected).where(columns.id > after_id).order_by(columns.id)
+    if 'coin' in args:
+        query = query.where(columns.coin_name == args['coin'].lower())
+    if since is not None:
+        query = query.where(columns.timestamp >= since)
+    if until is not None:
+        query = query.where(columns.timestamp <= until)
+
+    def project(row):
+        data = coin_history_row(row)
+        if 'id' not in fields:
+            del data['id']
+        return data
+
+    if args.get('format') == 'ndjson':
+        if limit is not None:
+            query = query.limit(limit)
+        engine = db.engine
+
+        def generate():
+            # Rows come from the cursor yield_per at a time, never the whole result
+            with engine.connect() as connection:
+                for row in connection.execution_options(yield_per=1000).execute(query):
+                    yield json.dumps(project(row)) + '\n'
+
+        return app.response_class(generate(), mimetype='application/x-ndjson')
+
+    limit = min(limit or API_PAGE_SIZE, API_MAX_PAGE_SIZE)
+    rows = db.session.execute(query.limit(limit)).all()
+    response = jsonify([project(row) for row in rows])
+    if len(rows) == limit:
+        response.headers['X-Next-After-Id'] = str(rows[-1].id)
+    return response
+
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    # flask --app <this module> rebuild-rollups: recompute every rollup from coin_history
+    with db.engine.begin() as connection:
+        rows = rebuild_rollups(connection)
+    print(f"Rebuilt rollups from {rows} coin_history rows")
 
 
 def schedule_update():
-    # Schedule the update_history_with_new_data function to run every minute
-    schedule.every().minute.do(lambda: update_history_with_new_data(coin=None, data=None))
+    # Expire the volume windows every minute so idle coins drop stale extremes
+    schedule.every().minute.do(expire_volume_windows)
 
     # Keep running the scheduler
     while True:
@@ -395,29 +949,41 @@ def schedule_update():
 
 
 def debug_print_coin_history(coin_name):
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
     coin_history = coins_history.get(coin_name.lower())
     if not coin_history:
-        print(f"No history found for coin: {coin_name}")
+        logging.debug("No history found for coin: %s", coin_name)
         return
 
-    print(f"Debugging history for coin: {coin_name}")
+    logging.debug("Debugging history for coin: %s", coin_name)
     for key, value in coin_history.items():
-        if isinstance(value, list):
-            print(
-                f"{key}: {[{'timestamp': entry['timestamp'].isoformat(), 'volume': entry['volume'], 'price': entry['price']} for entry in value]}")
+        if isinstance(value, (list, SampleRing)):
+            logging.debug("%s: %s", key, [{'timestamp': entry['timestamp'].isoformat(), 'volume': entry['volume'],
+                                           'price': entry['price']} for entry in value])
         else:
-            print(f"{key}: {value}")
+            logging.debug("%s: %s", key, value)
 
 
 # Call this function after each update to print out the history
 debug_print_coin_history('BITCOIN')
 
-if __name__ == '__main__':
+
+def start_services():
+    # Everything the process that owns coins_history runs besides serving requests
     with app.app_context():
+        migrate(db.engine)  # Upgrade an existing database to the current schema
         db.create_all()  # Create the tables if they don't exist already
         load_coins_history()  # Load the coins history from the file
         sync_file_data_with_db()  # Sync data from the file with the DB
-    threading.Thread(target=schedule_update).start()
+        db_writer.start(db.engine)  # Batched CoinHistory inserts
+    ingest_pipeline.start()  # Applies the queued updates
+    threading.Thread(target=schedule_update, daemon=True).start()
+
+
+if __name__ == '__main__':
+    # Development server; see serve.py for running with several worker processes
+    start_services()
     app.run(host='0.0.0.0', port=5000, debug=True)
 
 
@@ -0,0 +1,91 @@
+import logging
+import pickle
+import struct
+import time
+from multiprocessing import shared_memory
+
+
+# Segment layout: sequence number, payload length, then the pickled payload.
+# The sequence is odd while the publisher is writing (a seqlock), so readers
+# never need a lock shared with the publisher; they retry a torn copy instead.
+_HEADER = struct.Struct('<QQ')
+
+
+class SnapshotTooLarge(Exception):
+    pass
+
+
+class SnapshotPublisher:
+    # Owns a shared memory segment and publishes one picklable object at a
+    # time into it, for SnapshotReaders in other processes. Only one process
+    # (and thread) may publish.
+
+    def __init__(self, size=16 * 1024 * 1024):
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + size)
+        self.name = self._shm.name
+        self.capacity = size
+        self.sequence = 0
+        self._last = None
+        _HEADER.pack_into(self._shm.buf, 0, 0, 0)
+
+    def publish(self, state):
+        # Returns False when nothing changed since the last publish
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if payload == self._last:
+            return False
+        if len(payload) > self.capacity:
+            raise SnapshotTooLarge(f"Snapshot of {len(payload)} bytes does not fit in {self.capacity}")
+        buf = self._shm.buf
+        self.sequence += 1  # odd: writing
+        _HEADER.pack_into(buf, 0, self.sequence, 0)
+        buf[_HEADER.size:_HEADER.size + len(payload)] = payload
+        _HEADER.pack_into(buf, 0, self.sequence + 1, len(payload))
+        self.sequence += 1  # even: readable
+        self._last = payload
+        return True
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SnapshotReader:
+    # Attaches to a SnapshotPublisher's segment by name. get() only unpickles
+    # when a new snapshot has been published, otherwise it is one header read.
+
+    def __init__(self, name, retry_delay=0.001):
+        # Readers are meant to be started by the publisher's process (multiprocessing
+        # children share its resource tracker), so the segment is unlinked once, by
+        # SnapshotPublisher.close()
+        self._shm = shared_memory.SharedMemory(name=name)
+        self.retry_delay = retry_delay
+        self._cached = (None, None)  # (sequence, state), replaced as one so threads never mix them
+
+    def sequence(self):
+        return _HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    def get(self):
+        buf = self._shm.buf
+        while True:
+            sequence, length = _HEADER.unpack_from(buf, 0)
+            cached_sequence, cached_state = self._cached
+            if sequence == cached_sequence:
+                return cached_state
+            if sequence == 0:
+                return None  # nothing published yet
+            if sequence % 2:
+                time.sleep(self.retry_delay)  # being written
+                continue
+            payload = bytes(buf[_HEADER.size:_HEADER.size + length])
+            if _HEADER.unpack_from(buf, 0)[0] != sequence:
+                continue  # overwritten while copying
+            try:
+                state = pickle.loads(payload)
+            except Exception as e:
+                logging.error(f"Unreadable shared snapshot {sequence}: {e}")
+                return cached_state
+            self._cached = (sequence, state)
+            return state
+
+    def close(self):
+        self._shm.close()
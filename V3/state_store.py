@@ -0,0 +1,84 @@
+import threading
+from contextlib import contextmanager
+
+from history_store import SampleRing
+
+
+def copy_history(history):
+    # Copy of one coin's history that later updates cannot change: the ring is
+    # copied, every other value is replaced rather than mutated by the writers
+    return {key: value.copy() if isinstance(value, SampleRing) else value for key, value in history.items()}
+
+
+class CoinStateStore:
+    # The per-coin histories (coins_history), safe to share between the request
+    # threads, the scheduler and the persistence path.
+    #
+    # Coins are spread over a fixed number of striped locks. A writer holds
+    # lock(coin) while it changes that coin's history (and anything else kept
+    # per coin), readers hold it or take snapshot(coin). snapshot_all() and
+    # all_locked() take every stripe, in order, for a view that is consistent
+    # across coins. Iterating the store walks a copy of the coin list, so coins
+    # added meanwhile never break a reader.
+    #
+    # Like the defaultdict it replaces, store[coin] creates a missing coin from
+    # the factory.
+
+    def __init__(self, factory, stripes=16):
+        self.factory = factory
+        self._histories = {}
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._registry_lock = threading.Lock()
+
+    def lock(self, coin):
+        return self._locks[hash(coin) % len(self._locks)]
+
+    @contextmanager
+    def all_locked(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    def __getitem__(self, coin):
+        history = self._histories.get(coin)
+        if history is None:
+            with self._registry_lock:
+                history = self._histories.get(coin)
+                if history is None:
+                    history = self._histories[coin] = self.factory()
+        return history
+
+    def get(self, coin, default=None):
+        return self._histories.get(coin, default)
+
+    def update(self, histories):
+        with self._registry_lock:
+            self._histories.update(histories)
+
+    def __contains__(self, coin):
+        return coin in self._histories
+
+    def __len__(self):
+        return len(self._histories)
+
+    def __iter__(self):
+        return iter(list(self._histories))
+
+    def keys(self):
+        return list(self._histories)
+
+    def items(self):
+        return list(self._histories.items())
+
+    def snapshot(self, coin):
+        with self.lock(coin):
+            history = self._histories.get(coin)
+            return None if history is None else copy_history(history)
+
+    def snapshot_all(self):
+        with self.all_locked():
+            return {coin: copy_history(history) for coin, history in self.items()}
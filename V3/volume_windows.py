@@ -0,0 +1,87 @@
+from collections import deque
+from datetime import timedelta
+
+
+# Sliding windows tracked for every coin
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(days=1),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+
+class WindowedExtremes:
+    # Min and max volume over a sliding time window, using two monotonic deques.
+    # The max deque holds samples with strictly decreasing volume, the min deque
+    # strictly increasing volume, so the extreme is always at the left end.
+    # Every sample is pushed and popped at most once per deque, which makes
+    # push() and expire() amortized O(1). Samples must arrive in time order.
+    __slots__ = ('span', '_max', '_min')
+
+    def __init__(self, span):
+        self.span = span
+        self._max = deque()
+        self._min = deque()
+
+    def push(self, sample):
+        volume = sample.volume
+        max_queue, min_queue = self._max, self._min
+        # A newer sample with an equal or more extreme volume outlives the older ones
+        while max_queue and max_queue[-1].volume <= volume:
+            max_queue.pop()
+        max_queue.append(sample)
+        while min_queue and min_queue[-1].volume >= volume:
+            min_queue.pop()
+        min_queue.append(sample)
+        self.expire(sample.timestamp)
+
+    def expire(self, now):
+        cutoff = now - self.span
+        max_queue, min_queue = self._max, self._min
+        while max_queue and max_queue[0].timestamp < cutoff:
+            max_queue.popleft()
+        while min_queue and min_queue[0].timestamp < cutoff:
+            min_queue.popleft()
+
+    def max(self):
+        return self._max[0] if self._max else None
+
+    def min(self):
+        return self._min[0] if self._min else None
+
+    def __len__(self):
+        return len(self._max) + len(self._min)
+
+
+class VolumeWindows:
+    # All sliding windows for one coin
+    __slots__ = ('windows',)
+
+    def __init__(self, spans=None):
+        spans = WINDOWS if spans is None else spans
+        self.windows = {name: WindowedExtremes(span) for name, span in spans.items()}
+
+    def push(self, sample):
+        for window in self.windows.values():
+            window.push(sample)
+
+    def expire(self, now):
+        for window in self.windows.values():
+            window.expire(now)
+
+    def __getitem__(self, name):
+        return self.windows[name]
+
+
+def extreme_entry(sample, current_time):
+    # Dashboard representation of a window extreme: volume, price and timestamp
+    # of the sample, plus how many days ago it was recorded
+    if sample is None:
+        return None
+    return {
+        'volume': sample.volume,
+        'price': sample.price,
+        'timestamp': sample.timestamp,
+        'days_ago': (current_time.date() - sample.timestamp.date()).days,
+    }
@@ -0,0 +1,133 @@
+import logging
+import queue
+import threading
+import time
+
+
+_STOP = object()
+
+
+class WriterBackedUp(Exception):
+    # Raised by put() when the queue stayed full for longer than put_timeout
+    pass
+
+
+class WriteBehindQueue:
+    # Buffers rows for one table and inserts them from a background thread.
+    #
+    # Rows are grouped into batches written with a single executemany INSERT in
+    # one transaction. A batch is flushed once it holds max_batch rows or
+    # flush_interval seconds after its first row arrived, whichever comes first.
+    # The queue holds at most max_pending rows; when it is full put() waits up
+    # to put_timeout seconds and then raises WriterBackedUp so the caller can
+    # push back on the client instead of growing memory without bound. Without
+    # a running writer thread nothing frees up room, so put() raises at once;
+    # rows the caller then gives up on are counted with discard().
+    # in_transaction(connection, batch), if given, runs inside the insert's
+    # transaction (for derived tables that must stay in step with this one), and
+    # on_flush(batch) is called with every batch once it is committed.
+    # observe_write(seconds), if given, gets the time each committed
+    # transaction took.
+
+    def __init__(self, table, max_batch=500, flush_interval=1.0, max_pending=10000, put_timeout=2.0, retries=3,
+                 in_transaction=None, on_flush=None, observe_write=None):
+        self.table = table
+        self.in_transaction = in_transaction
+        self.on_flush = on_flush
+        self.observe_write = observe_write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._engine = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self, engine):
+        # Safe to call more than once, only the first call starts the thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._engine = engine
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.table.name}', daemon=True)
+                self._thread.start()
+
+    def put(self, row):
+        try:
+            self._queue.put(row, block=self.running, timeout=self.put_timeout)
+        except queue.Full:
+            raise WriterBackedUp(f"{self.pending()} rows waiting for {self.table.name}")
+
+    def discard(self, count=1):
+        # Counts rows that were never queued as dropped
+        with self._lock:
+            self.rows_dropped += count
+
+    def stop(self, timeout=30):
+        # Flush everything queued so far and stop the writer thread
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Write-behind queue for {self.table.name} did not drain within {timeout}s, "
+                          f"{self.pending()} rows left unwritten")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            if row is _STOP:
+                break
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._write(batch)
+
+    def _write(self, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                started = time.perf_counter()
+                with self._engine.begin() as connection:
+                    connection.execute(self.table.insert(), batch)
+                    if self.in_transaction is not None:
+                        self.in_transaction(connection, batch)
+                if self.observe_write is not None:
+                    self.observe_write(time.perf_counter() - started)
+                self.rows_written += len(batch)
+                logging.debug("Persisted %d rows to %s", len(batch), self.table.name)
+                break
+            except Exception as e:
+                logging.error(f"Failed to insert {len(batch)} rows into {self.table.name} "
+                              f"(attempt {attempt}/{self.retries}): {e}")
+                time.sleep(0.5 * attempt)
+        else:
+            self.discard(len(batch))
+            return
+        if self.on_flush is not None:
+            try:
+                self.on_flush(batch)
+            except Exception as e:
+                logging.error(f"on_flush callback for {self.table.name} failed: {e}")
@@ -5,10 +5,18 @@ import schedule
 import threading
 import time
 import logging
+import atexit
+import os
+import sys
 from flask_sqlalchemy import SQLAlchemy
 
-# Configure basic logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'V3'))
+from log_setup import LogSampler, configure_logging
+
+# Log level from LOG_LEVEL (default INFO, an unknown level falls back to it);
+# records are written by a background thread, as in the V3 servers
+configure_logging()
+tick_log = LogSampler(every=100)  # for the messages logged on every sample
 
 app = Flask(__name__)
 
@@ -55,7 +63,7 @@ def update_history_with_new_data(coin, data):
         logging.info("Skipping update due to None coin or data.")
         return
 
-    logging.debug(f"Updating history for coin: {coin}")
+    logging.debug("Updating history for coin: %s", coin)
 
     current_time = datetime.utcnow()
     history = coins_history[coin]
@@ -94,7 +102,7 @@ def update_history_with_new_data(coin, data):
     last_24_hours_data = [entry for entry in history['current'] if current_time - entry['timestamp'] <= timedelta(hours=24)]
     if last_24_hours_data:
         volumes = [entry['volume'] for entry in last_24_hours_data]
-        logging.debug(f"Volumes within the last 24 hours for {coin}: {volumes}")
+        logging.debug("Volumes within the last 24 hours for %s: %s", coin, volumes)
         min_volume = min(volumes)
         max_volume = max(volumes)
 
@@ -110,7 +118,7 @@ def update_history_with_new_data(coin, data):
         if max_volume > history['monthly_max_volume']['volume']:
             history['monthly_max_volume'] = {'volume': max_volume, 'price': data['price'], 'timestamp': data['timestamp']}
 
-    logging.debug(f"Updated history for coin: {coin}: {history}")
+    tick_log.log(logging.DEBUG, coin, "Updated history for coin: %s: %s", coin, history)
 
 
 
@@ -189,7 +197,7 @@ def update_coin():
         logging.error(f"Error converting volume to float: {e}")
         return "Error processing volume", 400
 
-    logging.debug(f"Received coin info: {coin_info}, volume: {volume}")
+    tick_log.log(logging.DEBUG, 'received', "Received coin info: %s, volume: %s", coin_info, volume)
 
     coin_info['timestamp'] = datetime.utcnow()
     coin_info['volume'] = volume  # Volume is now a float
@@ -0,0 +1,137 @@
+# Alert rules, and the Telegram notifier against a local stub of the Bot API.
+# Run with: python -m pytest tests/test_alerts.py
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from alerts import Alert, AlertEngine, TelegramNotifier
+from history_store import Sample
+from volume_windows import VolumeWindows
+
+START = datetime(2024, 1, 1)
+
+
+class Coin:
+    # Feeds samples through the windows and the engine the way the servers do
+    def __init__(self, engine, name='bitcoin'):
+        self.engine = engine
+        self.name = name
+        self.windows = VolumeWindows()
+        self.samples = []
+
+    def add(self, minutes, volume):
+        sample = Sample(START + timedelta(minutes=minutes), '', '', '', 1.0, float(volume))
+        self.samples.append(sample)
+        self.windows.push(sample)
+        hour_ago = [s for s in self.samples if s.timestamp <= sample.timestamp - timedelta(hours=1)]
+        history = {'-1hour': hour_ago[-1] if hour_ago else None}
+        return [(alert.rule, alert.direction) for alert in self.engine.evaluate(self.name, [sample], history, self.windows)]
+
+
+def test_new_extremes_only_against_a_known_extreme():
+    fired = []
+    coin = Coin(AlertEngine(fired.append, change_threshold=1000, z_threshold=1000, cooldown=timedelta(0)))
+    assert coin.add(0, 100) == []  # first sample: nothing to beat
+    assert coin.add(1, 150) == [('30d_extreme', 'up')]  # a 30 day high is not reported as a 24h high too
+    assert coin.add(2, 120) == []
+    assert coin.add(3, 90) == [('30d_extreme', 'down')]
+    # After a day, 150 and 90 are out of the 24h window but still the 30 day extremes
+    assert coin.add(60 * 25, 120) == []
+    assert coin.add(60 * 25 + 1, 130) == [('24h_extreme', 'up')]
+    assert coin.add(60 * 25 + 2, 100) == [('24h_extreme', 'down')]
+    assert len(fired) == 4 and isinstance(fired[0], Alert)
+
+
+def test_change_against_one_hour_ago_is_deduplicated():
+    engine = AlertEngine(change_threshold=25.0, z_threshold=1000, cooldown=timedelta(minutes=30))
+    coin = Coin(engine)
+    for minute in range(0, 61, 10):
+        coin.add(minute, 100)
+    assert ('change_1hour', 'up') in coin.add(70, 130)
+    assert ('change_1hour', 'up') not in coin.add(80, 140)  # same alert within the cooldown
+    assert ('change_1hour', 'down') in coin.add(90, 70)  # the other direction is a different alert
+    assert ('change_1hour', 'up') in coin.add(110, 200)
+    assert engine.alerts_suppressed >= 1
+
+
+def test_zscore_after_warmup():
+    engine = AlertEngine(change_threshold=1000, z_threshold=4.0, z_warmup=30, cooldown=timedelta(0))
+    coin = Coin(engine)
+    for minute in range(40):
+        alerts = coin.add(minute, 1000 + (minute % 5))
+        assert ('zscore', 'up') not in alerts
+    assert ('zscore', 'up') in coin.add(40, 5000)
+
+
+class StubBotAPI(BaseHTTPRequestHandler):
+    # Answers sendMessage like the Bot API; the first `fail_first` requests get a 429
+    fail_first = 0
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        cls = type(self)
+        cls.requests.append((self.path, body, time.monotonic()))
+        if len(cls.requests) <= cls.fail_first:
+            self.reply(429, {'ok': False, 'parameters': {'retry_after': 0.05}})
+        elif body['chat_id'] == 'bad':
+            self.reply(400, {'ok': False, 'description': 'Bad Request: chat not found'})
+        else:
+            self.reply(200, {'ok': True, 'result': {'message_id': len(cls.requests)}})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub(fail_first=0):
+    handler = type('Stub', (StubBotAPI,), {'fail_first': fail_first, 'requests': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def make_alert(n):
+    return Alert('bitcoin', 'zscore', 'up', 1000.0 + n, 5.0, START)
+
+
+def test_notifier_retries_and_rate_limits():
+    server, stub, url = run_stub(fail_first=1)
+    notifier = TelegramNotifier('123:secret', '42', base_url=url, rate=2, per=0.5, retries=3)
+    try:
+        started = time.monotonic()
+        for n in range(4):
+            notifier.notify(make_alert(n))
+        assert time.monotonic() - started < 0.5  # notify() never waits for a send
+        notifier.stop()
+    finally:
+        server.shutdown()
+    assert notifier.stats() == {'sent': 4, 'failed': 0, 'dropped': 0, 'pending': 0}
+    assert len(stub.requests) == 5  # one 429, retried
+    path, body, _ = stub.requests[-1]
+    assert path == '/bot123:secret/sendMessage' and body['chat_id'] == '42' and 'BITCOIN' in body['text']
+    # 2 messages per 0.5s: the 4th send waits for the bucket to refill
+    assert stub.requests[-1][2] - stub.requests[0][2] >= 0.4
+
+
+def test_notifier_gives_up_on_client_errors():
+    server, stub, url = run_stub()
+    notifier = TelegramNotifier('123:secret', 'bad', base_url=url, retries=3)
+    try:
+        notifier.notify(make_alert(0))
+        notifier.stop()
+    finally:
+        server.shutdown()
+    assert notifier.stats()['failed'] == 1 and len(stub.requests) == 1
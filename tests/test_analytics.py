@@ -0,0 +1,120 @@
+# The batched dashboard statistics of analytics.py, checked against brute
+# force and against the monotonic-deque windows.
+# Run with: python -m pytest tests/test_analytics.py
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from analytics import columns_from_database, dashboard_stats, epoch_seconds, load_columns, save_columns
+from history_store import Sample
+from volume_windows import VolumeWindows, WINDOWS
+
+START = datetime(2024, 1, 1)
+MARKS = {'-30mins': timedelta(minutes=30), '-1hour': timedelta(hours=1), 'yesterday': timedelta(days=1)}
+
+
+def make_sample(minutes, volume):
+    return Sample(START + timedelta(minutes=minutes), '', '', '', 1.5, float(volume))
+
+
+def random_coins(rng, coins=12):
+    # {coin: samples oldest first}, including a coin without samples and repeated volumes
+    result = {}
+    for n in range(coins):
+        minute, samples = 0.0, []
+        for _ in range(rng.randrange(0, 300) if n else 0):
+            minute += rng.expovariate(1 / 12)
+            samples.append(make_sample(minute, rng.choice([100, 200, 300, rng.uniform(0, 1000)])))
+        result[f'coin{n}'] = samples
+    return result
+
+
+def as_columns(samples):
+    return (np.array([epoch_seconds(sample.timestamp) for sample in samples]),
+            np.array([sample.volume for sample in samples]), np.array([sample.price for sample in samples]))
+
+
+def newest(samples, keep):
+    matching = [sample for sample in samples if keep(sample)]
+    return matching[-1] if matching else None
+
+
+def test_dashboard_stats_match_brute_force_and_windows():
+    coins = random_coins(random.Random(11))
+    now = START + timedelta(minutes=1800)
+    result = dashboard_stats({coin: as_columns(samples) for coin, samples in coins.items()}, now, MARKS,
+                             WINDOWS).as_dict()
+    assert list(result) == list(coins)
+
+    for coin, samples in coins.items():
+        until_now = [sample for sample in samples if sample.timestamp <= now]
+        latest = until_now[-1] if until_now else None
+        assert (result[coin]['latest'] or {}).get('volume') == (latest.volume if latest else None)
+        for key, delta in MARKS.items():
+            expected = newest(samples, lambda sample: sample.timestamp <= now - delta)
+            entry = result[coin]['lookbacks'][key]
+            if expected is None:
+                assert entry is None
+                continue
+            assert entry['volume'] == expected.volume and entry['price'] == 1.5
+            if expected.volume:
+                assert entry['change_percent'] == round((latest.volume - expected.volume) / expected.volume * 100, 4)
+
+        windows = VolumeWindows()
+        for sample in until_now:
+            windows.push(sample)
+        windows.expire(now)
+        for name in WINDOWS:
+            for side in ('min', 'max'):
+                expected = getattr(windows[name], side)()
+                entry = result[coin]['windows'][name][side]
+                if expected is None:
+                    assert entry is None
+                else:
+                    assert datetime.fromisoformat(entry['timestamp']) == expected.timestamp
+                    assert entry['volume'] == expected.volume
+
+
+def test_dashboard_stats_from_memory_mapped_columns(tmp_path):
+    coins = random_coins(random.Random(3), coins=4)
+    columns = {coin: as_columns(samples) for coin, samples in coins.items()}
+    save_columns(str(tmp_path), {'a/b coin': columns['coin1'], **columns})
+    loaded = load_columns(str(tmp_path))
+    assert set(loaded) == set(columns) | {'a/b coin'}
+    assert isinstance(loaded['coin1'][0], np.memmap)
+    now = START + timedelta(minutes=1000)
+    expected = dashboard_stats(columns, now, MARKS, WINDOWS).as_dict()
+    assert dashboard_stats({coin: loaded[coin] for coin in columns}, now, MARKS, WINDOWS).as_dict() == expected
+
+
+def test_columns_from_text_and_numeric_database(tmp_path):
+    # Text volumes and prices, as before the REAL columns migration, and numbers after it
+    path = tmp_path / 'coins.db'
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE coin_history (id INTEGER PRIMARY KEY, coin_name VARCHAR(50), '
+                       'timestamp DATETIME, volume, change VARCHAR(20), direction VARCHAR(20), price)')
+    rows = [('btc', START + timedelta(minutes=2), '1,500.0', '$60,000.50'),
+            ('btc', START, '1000', 'Unavailable'),
+            ('eth', START + timedelta(minutes=1), 2000.0, 3.5),
+            ('eth', START - timedelta(days=40), 1.0, 1.0)]
+    connection.executemany('INSERT INTO coin_history (coin_name, timestamp, volume, change, direction, price) '
+                           "VALUES (?, ?, ?, '', '', ?)", [(c, t.isoformat(' '), v, p) for c, t, v, p in rows])
+    connection.commit()
+    connection.close()
+
+    columns = columns_from_database(f'sqlite:///{path}', days=31)
+    assert columns['btc'][0].tolist() == [epoch_seconds(START), epoch_seconds(START + timedelta(minutes=2))]
+    assert columns['btc'][1].tolist() == [1000.0, 1500.0]
+    assert np.isnan(columns['btc'][2][0]) and columns['btc'][2][1] == 60000.5
+    assert columns['eth'][1].tolist() == [2000.0]  # the 40 days old row is outside --days
+    assert columns_from_database(f'sqlite:///{path}', until=START + timedelta(minutes=1))['btc'][1].tolist() == [1000.0]
+
+
+def test_dashboard_stats_without_coins():
+    stats = dashboard_stats({}, START, MARKS, WINDOWS)
+    assert stats.as_dict() == {} and stats.lookbacks.shape == (0, len(MARKS))
@@ -0,0 +1,52 @@
+# Migration of a V3 database from before the schema versions to the current schema.
+# Run with: python -m pytest tests/test_db_migrations.py
+import os
+import sqlite3
+import sys
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from db_migrations import SCHEMA_VERSION, migrate
+
+
+def test_text_columns_of_a_version_0_database_become_real(tmp_path):
+    # The coin_history table as the original serverV3.py created it, volume and price as text
+    path = tmp_path / 'coins.db'
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE coin_history (id INTEGER NOT NULL, coin_name VARCHAR(50) NOT NULL, '
+                       'timestamp DATETIME, volume VARCHAR(20), change VARCHAR(20), direction VARCHAR(20), '
+                       'price VARCHAR(20), PRIMARY KEY (id))')
+    connection.executemany('INSERT INTO coin_history VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        (1, 'btc', '2024-01-01 00:00:00.000000', '1,500.5', '1%', 'Increase', '$60,000.25'),
+        (2, 'btc', '2024-01-01 00:01:00.000000', '2000', '2%', 'Increase', 'Unavailable'),
+        (3, 'eth', '2024-01-01 00:00:30.000000', 'n/a', '-1%', 'Decrease', '$3'),
+    ])
+    connection.commit()
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == 0
+    connection.close()
+
+    engine = create_engine(f'sqlite:///{path}')
+    migrate(engine)
+    migrate(engine)  # a second run finds nothing left to do
+    engine.dispose()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    columns = {row[1]: row[2] for row in connection.execute('PRAGMA table_info(coin_history)')}
+    assert columns['volume'] == 'FLOAT' and columns['price'] == 'FLOAT'
+    assert connection.execute('SELECT id, coin_name, timestamp, volume, change, direction, price FROM coin_history '
+                              'ORDER BY id').fetchall() == [
+        (1, 'btc', '2024-01-01 00:00:00.000000', 1500.5, '1%', 'Increase', 60000.25),
+        (2, 'btc', '2024-01-01 00:01:00.000000', 2000.0, '2%', 'Increase', None),
+        (3, 'eth', '2024-01-01 00:00:30.000000', None, '-1%', 'Decrease', 3.0),
+    ]
+    assert connection.execute("SELECT typeof(volume), typeof(price) FROM coin_history WHERE id = 1").fetchone() == (
+        'real', 'real')
+    indexes = {row[1]: [column[2] for column in connection.execute(f'PRAGMA index_info({row[1]})')]
+               for row in connection.execute('PRAGMA index_list(coin_history)')}
+    assert indexes['ix_coin_history_coin_name_timestamp'] == ['coin_name', 'timestamp']
+    plan = ' '.join(row[3] for row in connection.execute(
+        "EXPLAIN QUERY PLAN SELECT timestamp FROM coin_history WHERE coin_name = 'btc' AND timestamp >= '2024'"))
+    assert 'ix_coin_history_coin_name_timestamp' in plan
+    connection.close()
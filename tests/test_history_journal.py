@@ -0,0 +1,65 @@
+# Replay of the V3 history journal after a crash and after compaction.
+# Run with: python -m pytest tests/test_history_journal.py
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from history_journal import HistoryJournal
+
+
+def make_journal(tmp_path, snapshot_every=500):
+    return HistoryJournal(str(tmp_path / 'coins_history.txt'), str(tmp_path / 'coins_history.journal'),
+                          snapshot_every)
+
+
+def sample(volume):
+    return {'timestamp': '2024-01-01T00:00:00', 'volume': volume}
+
+
+def test_replay_cuts_off_a_torn_tail(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.extend('btc', [sample(1), sample(2)])
+    journal.append('eth', sample(3))
+    journal.close()
+    intact = os.path.getsize(journal.journal_path)
+    with open(journal.journal_path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00{"torn')  # a crash in the middle of writing a record
+
+    restarted = make_journal(tmp_path)
+    assert list(restarted.replay()) == [('btc', sample(1)), ('btc', sample(2)), ('eth', sample(3))]
+    assert os.path.getsize(journal.journal_path) == intact
+
+    # New records go right after the last good one
+    restarted.append('btc', sample(4))
+    restarted.close()
+    assert [data['volume'] for _, data in make_journal(tmp_path).replay()] == [1, 2, 3, 4]
+
+
+def test_replay_after_compaction(tmp_path):
+    journal = make_journal(tmp_path, snapshot_every=2)
+    assert not journal.append('btc', sample(1))
+    assert journal.append('btc', sample(2))
+    assert journal.begin_snapshot()
+    journal.append('btc', sample(3))  # journaled while the snapshot is being written
+    journal.write_snapshot({'btc': {'current': [sample(2), sample(1)]}})
+    journal.append('btc', sample(4))
+    journal.close()
+
+    restarted = make_journal(tmp_path, snapshot_every=2)
+    with open(restarted.snapshot_path) as f:
+        assert json.load(f) == {'btc': {'current': [sample(2), sample(1)]}}
+    assert [data['volume'] for _, data in restarted.replay()] == [3, 4]
+    assert not os.path.exists(restarted.compacting_path)
+    assert restarted.records_since_snapshot == 2
+
+
+def test_replay_keeps_the_records_of_an_unfinished_snapshot(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.append('btc', sample(1))
+    journal.begin_snapshot()
+    journal.append('btc', sample(2))
+    journal.close()  # crash before write_snapshot()
+
+    restarted = make_journal(tmp_path)
+    assert [data['volume'] for _, data in restarted.replay()] == [1, 2]
@@ -0,0 +1,62 @@
+# Volume extremes survive a restart of tests/testserver.py: the saved extremes
+# seed the sliding windows, so the first new sample doesn't replace them.
+# Run with: python -m pytest tests/test_restart.py
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import testserver
+
+
+def entry(timestamp, volume):
+    return {'timestamp': timestamp, 'change': '1%', 'volume_short': '', 'direction': 'Increase', 'price': '$1',
+            'volume': volume}
+
+
+def restart_with(tmp_path, monkeypatch, saved):
+    path = tmp_path / 'coins_history.txt'
+    path.write_text(json.dumps(saved, default=str))
+    monkeypatch.setattr(testserver, 'COINS_HISTORY_FILE', str(path))
+    testserver.coins_history.clear()
+    testserver.coins_volume_windows.clear()
+    testserver.load_coins_history()
+
+
+def test_restart_then_one_new_sample(tmp_path, monkeypatch):
+    now = datetime.utcnow()
+    restart_with(tmp_path, monkeypatch, {'bitcoin': {
+        'current': [entry(now - timedelta(hours=1), 200), entry(now - timedelta(hours=2), 150)],
+        'monthly_max_volume': entry(now - timedelta(days=10), 5000),
+        'monthly_min_volume': entry(now - timedelta(days=20), 10),
+        '24_hour_max_volume': entry(now - timedelta(hours=5), 900),
+        '24_hour_min_volume': entry(now - timedelta(hours=6), 50),
+    }})
+
+    testserver.update_history_with_new_data('bitcoin', entry(now, 300))
+
+    history = testserver.coins_history['bitcoin']
+    assert history['monthly_max_volume']['volume'] == 5000
+    assert history['monthly_min_volume']['volume'] == 10
+    assert history['24_hour_max_volume']['volume'] == 900
+    assert history['24_hour_min_volume']['volume'] == 50
+
+
+def test_saved_extremes_past_their_window_are_dropped(tmp_path, monkeypatch):
+    now = datetime.utcnow()
+    restart_with(tmp_path, monkeypatch, {'bitcoin': {
+        'current': [],
+        'monthly_max_volume': entry(now - timedelta(days=40), 5000),  # past the 30 day window
+        'monthly_min_volume': {'volume': float('inf'), 'price': None, 'timestamp': None},  # never set
+        '24_hour_max_volume': entry(now - timedelta(days=2), 900),  # only still inside 30 days
+        '24_hour_min_volume': entry(now - timedelta(days=2), 900),
+    }})
+
+    testserver.update_history_with_new_data('bitcoin', entry(now, 300))
+
+    history = testserver.coins_history['bitcoin']
+    assert history['monthly_max_volume']['volume'] == 900
+    assert history['monthly_min_volume']['volume'] == 300
+    assert history['24_hour_max_volume']['volume'] == 300
+    assert history['24_hour_min_volume']['volume'] == 300
@@ -0,0 +1,143 @@
+# Concurrency stress test for the V3 coin state store and the snapshot/journal path.
+# Run with: python -m pytest tests/test_state_store.py
+import json
+import os
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from history_journal import HistoryJournal
+from history_store import Sample, SampleRing
+from state_store import CoinStateStore
+
+WRITERS = 8
+UPDATES_PER_WRITER = 2000
+COINS = 20
+START = datetime(2024, 1, 1)
+
+
+def new_history(capacity=50):
+    return {'current': SampleRing(capacity), 'count': 0, 'last': None}
+
+
+def make_sample(sequence):
+    return Sample(START + timedelta(seconds=sequence), '1%', str(sequence), 'Increase', '$1', float(sequence))
+
+
+def apply(store, coin, sample):
+    with store.lock(coin):
+        history = store[coin]
+        history['current'].append(sample)
+        history['count'] += 1
+        history['last'] = sample
+
+
+def check_consistent(histories, capacity=50):
+    for coin, history in histories.items():
+        assert len(history['current']) == min(history['count'], capacity), coin
+        if history['count']:
+            assert history['current'][0] is history['last'], coin
+
+
+def run_threads(targets):
+    errors = []
+
+    def guarded(target):
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guarded, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def test_concurrent_updates_and_snapshots():
+    store = CoinStateStore(new_history, stripes=4)
+    writers_done = threading.Event()
+    remaining = [WRITERS]
+    remaining_lock = threading.Lock()
+
+    def writer(offset):
+        def run():
+            rng = random.Random(offset)
+            for i in range(UPDATES_PER_WRITER):
+                # New coins keep appearing while readers iterate
+                apply(store, f'coin{rng.randrange(COINS)}-{i % 3}', make_sample(offset * UPDATES_PER_WRITER + i))
+            with remaining_lock:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    writers_done.set()
+        return run
+
+    def snapshot_reader():
+        while not writers_done.is_set():
+            check_consistent(store.snapshot_all())
+
+    def coin_reader():
+        while not writers_done.is_set():
+            for coin in store:
+                snapshot = store.snapshot(coin)
+                check_consistent({coin: snapshot})
+
+    run_threads([writer(n) for n in range(WRITERS)] + [snapshot_reader, coin_reader, coin_reader])
+
+    histories = store.snapshot_all()
+    check_consistent(histories)
+    assert sum(history['count'] for history in histories.values()) == WRITERS * UPDATES_PER_WRITER
+
+
+def test_snapshot_copies_are_isolated():
+    store = CoinStateStore(new_history)
+    apply(store, 'bitcoin', make_sample(1))
+    snapshot = store.snapshot('bitcoin')
+    apply(store, 'bitcoin', make_sample(2))
+    assert len(snapshot['current']) == 1 and snapshot['count'] == 1
+    assert store.snapshot('missing') is None and 'missing' not in store
+
+
+def test_compaction_under_load_loses_no_sample(tmp_path):
+    # Writers journal every sample under the coin lock while compactions run
+    # the way save_coins_history() does; snapshot + replay must hold them all.
+    snapshot_path = str(tmp_path / 'coins_history.txt')
+    journal = HistoryJournal(snapshot_path, str(tmp_path / 'coins_history.journal'), snapshot_every=50)
+    store = CoinStateStore(lambda: new_history(capacity=WRITERS * UPDATES_PER_WRITER), stripes=4)
+
+    def save():
+        with store.all_locked():
+            if not journal.begin_snapshot(blocking=False):
+                return
+            state = store.snapshot_all()
+        journal.write_snapshot({coin: list(history['current']) for coin, history in state.items()})
+
+    def writer(offset):
+        def run():
+            rng = random.Random(offset)
+            for i in range(UPDATES_PER_WRITER // 4):
+                sequence = offset * UPDATES_PER_WRITER + i
+                coin = f'coin{rng.randrange(COINS)}'
+                with store.lock(coin):
+                    apply(store, coin, make_sample(sequence))
+                    compact = journal.append(coin, {'volume': sequence})
+                if compact:
+                    save()
+        return run
+
+    run_threads([writer(n) for n in range(WRITERS)])
+    journal.close()
+
+    written = {offset * UPDATES_PER_WRITER + i for offset in range(WRITERS) for i in range(UPDATES_PER_WRITER // 4)}
+    recovered = set()
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path) as f:
+            for samples in json.load(f).values():
+                recovered.update(int(sample['volume']) for sample in samples)
+    recovered.update(data['volume'] for _, data in HistoryJournal(snapshot_path, journal.journal_path).replay())
+    assert recovered == written
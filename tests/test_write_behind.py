@@ -0,0 +1,62 @@
+# Shutdown behaviour of the V3 write-behind queue.
+# Run with: python -m pytest tests/test_write_behind.py
+import os
+import sys
+import time
+
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, create_engine, select
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from write_behind import WriteBehindQueue, WriterBackedUp
+
+metadata = MetaData()
+samples = Table('samples', metadata, Column('id', Integer, primary_key=True), Column('coin_name', String(50)),
+                Column('volume', Float))
+
+
+def make_engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "samples.db"}')
+    metadata.create_all(engine)
+    return engine
+
+
+def stored_volumes(engine):
+    with engine.connect() as connection:
+        return [row.volume for row in connection.execute(select(samples.c.volume).order_by(samples.c.id))]
+
+
+def test_stop_flushes_pending_rows(tmp_path):
+    engine = make_engine(tmp_path)
+    writer = WriteBehindQueue(samples, flush_interval=60)  # only stop() ends the batch
+    writer.start(engine)
+    for volume in range(5):
+        writer.put({'coin_name': 'btc', 'volume': float(volume)})
+
+    started = time.monotonic()
+    writer.stop()
+    assert time.monotonic() - started < 5
+    assert not writer.running
+    assert writer.rows_written == 5 and writer.pending() == 0
+    assert stored_volumes(engine) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    engine.dispose()
+
+
+def test_put_after_stop_neither_blocks_nor_retries(tmp_path):
+    engine = make_engine(tmp_path)
+    writer = WriteBehindQueue(samples, max_pending=2, put_timeout=10)
+    writer.start(engine)
+    writer.stop()
+
+    started = time.monotonic()
+    writer.put({'coin_name': 'btc', 'volume': 1.0})
+    writer.put({'coin_name': 'btc', 'volume': 2.0})
+    with pytest.raises(WriterBackedUp):
+        writer.put({'coin_name': 'btc', 'volume': 3.0})  # full, and no writer left to make room
+    assert time.monotonic() - started < 1
+    writer.discard()
+    assert writer.rows_dropped == 1 and writer.pending() == 2
+
+    writer.stop()  # returns at once, there is no thread to wait for
+    assert writer.rows_written == 0 and stored_volumes(engine) == []
+    engine.dispose()
@@ -16,6 +16,13 @@ import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
+import os
+import sys
+
+# Reuse the sliding-window engine from the V3 server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'V3'))
+from history_store import Sample
+from volume_windows import VolumeWindows, extreme_entry
 
 
 
@@ -42,6 +49,10 @@ coins_history = defaultdict(lambda: {
     '-30mins': None, '-1hour': None, '-1.5hours': None, '-2hours': None, '-12hours': None, 'yesterday': None
 })
 
+# Sliding 1h/24h/7d/30d volume extremes per coin
+coins_volume_windows = defaultdict(VolumeWindows)
+EXTREME_KEYS = ('monthly_max_volume', 'monthly_min_volume', '24_hour_max_volume', '24_hour_min_volume')
+
 
 def save_coins_history():
     with open(COINS_HISTORY_FILE, 'w') as f:
@@ -60,6 +71,7 @@ def load_coins_history():
             for coin, history in data_loaded.items():
                 for entry in history['current']:
                     entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+                seed_volume_windows(coin, history)
 
             # Replace the existing coins_history with the loaded data
             coins_history.update(data_loaded)
@@ -71,6 +83,18 @@ def load_coins_history():
 
 
 
+def seed_volume_windows(coin, history):
+    # Rebuild the coin's sliding windows from the saved extremes plus the recent
+    # samples, so the first sample after a restart doesn't replace a month of extremes
+    seeds = [Sample.from_dict(history[key]) for key in EXTREME_KEYS
+             if history.get(key) and history[key].get('timestamp')]
+    seeds.extend(Sample.from_dict(entry) for entry in history['current'])
+    windows = coins_volume_windows[coin]
+    for sample in sorted(seeds, key=lambda sample: sample.timestamp):
+        windows.push(sample)
+    windows.expire(datetime.utcnow())  # saved extremes past their window drop out here
+
+
 # Unformat volume for comparisons
 def unformat_volume(volume_str):
     volume_str = volume_str.replace(',', '')
@@ -184,10 +208,6 @@ def update_history_with_new_data(coin, data):
     # Keep only the 100 most recent entries for 'current'
     history['current'] = history['current'][:300]
 
-    # Calculate days ago for monthly max/min
-    def calculate_days_ago(timestamp):
-        return (current_time.date() - timestamp.date()).days
-
     # Update historical intervals and monthly min/max volumes
     for minutes, key in zip([30, 60, 90, 120, 720, 1440], ['-30mins', '-1hour', '-1.5hours', '-2hours', '-12hours', 'yesterday']):
         mark = current_time - timedelta(minutes=minutes)
@@ -196,24 +216,6 @@ def update_history_with_new_data(coin, data):
         history[key] = closest_entry
 
     # Update 24-hour and monthly min/max volumes
-    recent_entries = [entry for entry in history['current'] if current_time - entry['timestamp'] <= timedelta(days=1)]
-    if recent_entries:
-        volumes = [entry['volume'] for entry in recent_entries]
-        min_volume_entry = min(recent_entries, key=lambda entry: entry['volume'])
-        max_volume_entry = max(recent_entries, key=lambda entry: entry['volume'])
-
-        history['24_hour_min_volume'] = min_volume_entry
-        history['24_hour_max_volume'] = max_volume_entry
-
-        # Check and update monthly volumes if necessary
-        if min_volume_entry['volume'] < history['monthly_min_volume'].get('volume', float('inf')):
-            history['monthly_min_volume'] = min_volume_entry
-            history['monthly_min_volume']['days_ago'] = calculate_days_ago(min_volume_entry['timestamp'])
-
-        if max_volume_entry['volume'] > history['monthly_max_volume'].get('volume', 0):
-            history['monthly_max_volume'] = max_volume_entry
-            history['monthly_max_volume']['days_ago'] = calculate_days_ago(max_volume_entry['timestamp'])
-
     update_monthly_volumes(coin, data)
     save_coins_history()
     logging.debug(f"Updated history for coin: {coin}")
@@ -284,25 +286,16 @@ def update_monthly_volumes(coin, data):
     history = coins_history[coin]
     current_time = datetime.utcnow()
 
-    # Ensure 'data' contains volume and price, and timestamp is the current time
-    new_volume = data['volume']
-    new_price = data['price']
-
-    # Update monthly max volume if new volume is greater
-    if new_volume > history['monthly_max_volume'].get('volume', 0):
-        history['monthly_max_volume'] = {
-            'volume': new_volume,
-            'price': new_price,
-            'timestamp': current_time,  # Use current time for the update timestamp
-        }
-
-    # Update monthly min volume if new volume is less
-    if new_volume < history['monthly_min_volume'].get('volume', float('inf')):
-        history['monthly_min_volume'] = {
-            'volume': new_volume,
-            'price': new_price,
-            'timestamp': current_time,  # Use current time for the update timestamp
-        }
+    # Push the sample through the sliding windows; extremes older than the
+    # window expire instead of being kept forever
+    windows = coins_volume_windows[coin]
+    windows.push(Sample.from_dict(data))
+    windows.expire(current_time)
+
+    history['24_hour_min_volume'] = extreme_entry(windows['24h'].min(), current_time)
+    history['24_hour_max_volume'] = extreme_entry(windows['24h'].max(), current_time)
+    history['monthly_min_volume'] = extreme_entry(windows['30d'].min(), current_time)
+    history['monthly_max_volume'] = extreme_entry(windows['30d'].max(), current_time)
 
 @app.route('/')
 def index():